@@ -0,0 +1,52 @@
+"""Measure the image decoding throughput of the available decoder backends."""
+
+import pathlib
+import time
+from argparse import ArgumentDefaultsHelpFormatter, ArgumentParser
+
+import torch as th
+
+from src.pytorchfwd.fwd import IMAGE_EXTS
+from src.pytorchfwd.utils import DECODERS, ImagePathDataset
+
+
+def _parse_args():
+    parser = ArgumentParser(formatter_class=ArgumentDefaultsHelpFormatter)
+    parser.add_argument("path", type=str, help="Image directory.")
+    parser.add_argument("--batch-size", type=int, default=128, help="Batch size.")
+    parser.add_argument(
+        "--num-processes", type=int, default=0, help="Number of loader workers."
+    )
+    return parser.parse_args()
+
+
+def measure_throughput(
+    img_names: list, decoder: str, batch_size: int, num_workers: int
+) -> float:
+    """Decode all images once and return the throughput in images per second."""
+    dataset = ImagePathDataset(img_names, decoder=decoder)
+    dataloader = th.utils.data.DataLoader(
+        dataset,
+        batch_size=batch_size,
+        shuffle=False,
+        drop_last=False,
+        num_workers=num_workers,
+        collate_fn=dataset.collate,
+    )
+    start = time.perf_counter()
+    for _ in dataloader:
+        pass
+    return len(img_names) / (time.perf_counter() - start)
+
+
+if __name__ == "__main__":
+    args = _parse_args()
+    posfix_path = pathlib.Path(args.path)
+    img_names = sorted(
+        [name for ext in IMAGE_EXTS for name in posfix_path.glob(f"*.{ext}")]
+    )
+    for decoder in DECODERS:
+        throughput = measure_throughput(
+            img_names, decoder, args.batch_size, args.num_processes
+        )
+        print(f"{decoder}: {throughput:.1f} images/sec")
@@ -0,0 +1,116 @@
+"""Compute FWD, FID and WPKL from a single decode of every image.
+
+A command line front end of `pytorchfwd.evaluate.evaluate`, which also
+describes the disk space the temporary image caches need. This script
+adds the InceptionV3 features of the FID.
+
+Run from the repository root with
+``python -m scripts.evaluate <path 1> <path 2>``.
+"""
+
+from argparse import ArgumentDefaultsHelpFormatter, ArgumentParser
+
+from scripts.fid.fid import InceptionV3, compute_features
+from src.pytorchfwd import fwd
+from src.pytorchfwd.evaluate import METRICS, evaluate
+from src.pytorchfwd.freq_math import FRECHET_BACKENDS
+
+
+def _inception_features(dims: int):
+    model = InceptionV3([InceptionV3.BLOCK_INDEX_BY_DIM[dims]]).eval()
+
+    def feature_fn(batch):
+        # follow the images onto the device of this rank, a no-op after the first batch.
+        return compute_features(model.to(batch.device), batch)
+
+    return feature_fn
+
+
+def _parse_args():
+    parser = ArgumentParser(formatter_class=ArgumentDefaultsHelpFormatter)
+    parser.add_argument(
+        "path", type=str, nargs=2, help="Image directories or decoded image caches."
+    )
+    parser.add_argument(
+        "--metrics",
+        type=str,
+        nargs="+",
+        default=list(METRICS),
+        choices=METRICS,
+        help="Metrics to compute.",
+    )
+    parser.add_argument("--batch-size", type=int, default=128, help="Batch size.")
+    parser.add_argument(
+        "--num-processes", type=int, default=0, help="Number of loader workers."
+    )
+    parser.add_argument(
+        "--decoder",
+        type=str,
+        default="pil",
+        choices=["pil", "torchvision"],
+        help="Image decoder backend.",
+    )
+    parser.add_argument(
+        "--wavelet", type=str, default="sym5", help="Choice of wavelet."
+    )
+    parser.add_argument(
+        "--max_level", type=int, default=4, help="wavelet decomposition level"
+    )
+    parser.add_argument(
+        "--log_scale", action="store_true", help="Use log scaling for wavelets."
+    )
+    parser.add_argument(
+        "--precision",
+        type=str,
+        default="float64",
+        choices=["float32", "float64"],
+        help="Precision of the wavelet packet transform.",
+    )
+    parser.add_argument(
+        "--frechet-backend",
+        type=str,
+        default="torch",
+        choices=FRECHET_BACKENDS,
+        help="Backend for the per-packet Frechet distances.",
+    )
+    parser.add_argument(
+        "--dims",
+        type=int,
+        default=2048,
+        choices=list(InceptionV3.BLOCK_INDEX_BY_DIM),
+        help="Dimensionality of Inception features to use.",
+    )
+    parser.add_argument(
+        "--tmp-dir",
+        type=str,
+        default=None,
+        help="Directory for the temporary image caches of the WPKL histogram pass, "
+        "they need the uint8 size of all decoded images.",
+    )
+    return parser.parse_args()
+
+
+def main():
+    """Compute the requested metrics of two image paths."""
+    args = _parse_args()
+    print(args)
+    fwd.NUM_PROCESSES = args.num_processes
+    fwd.DECODER = args.decoder
+    results = evaluate(
+        args.path,
+        args.wavelet,
+        args.max_level,
+        args.log_scale,
+        args.batch_size,
+        metrics=args.metrics,
+        frechet_backend=args.frechet_backend,
+        dtype=fwd.PRECISIONS[args.precision],
+        feature_fn=_inception_features(args.dims) if "fid" in args.metrics else None,
+        tmp_dir=args.tmp_dir,
+    )
+    for metric, value in results.items():
+        print(f"{metric.upper()}: {value}")
+
+
+if __name__ == "__main__":
+    main()
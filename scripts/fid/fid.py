@@ -44,6 +44,7 @@ WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 See the License for the specific language governing permissions and
 limitations under the License.
 """
+
 import os
 import pathlib
 from argparse import ArgumentDefaultsHelpFormatter, ArgumentParser
@@ -79,6 +80,11 @@ try:
 except ImportError:
     from .inception import InceptionV3
 
+try:
+    from pytorchfwd.evaluate import FeatureStatistics
+except ImportError:
+    from src.pytorchfwd.evaluate import FeatureStatistics
+
 parser = ArgumentParser(formatter_class=ArgumentDefaultsHelpFormatter)
 parser.add_argument("--batch-size", type=int, default=50, help="Batch size to use")
 parser.add_argument(
@@ -117,27 +123,39 @@ class ImagePathDataset(torch.utils.data.Dataset):
         return img
 
 
-def get_activations(files, model, batch_size=50, dims=2048, device="cpu", resize=0):
-    """Calculates the activations of the pool_3 layer for all images.
+def compute_features(model, batch):
+    """Calculates the pooled activations of a batch of images.
 
     Params:
-    -- files       : List of image files paths
     -- model       : Instance of inception model
-    -- batch_size  : Batch size of images for the model to process at once.
-                     Make sure that the number of samples is a multiple of
-                     the batch size, otherwise some samples are ignored. This
-                     behavior is retained to match the original FID score
-                     implementation.
-    -- dims        : Dimensionality of features returned by Inception
-    -- device      : Device to run calculations
+    -- batch       : Float images of shape (batch size, 3, height, width)
+                     with values in [0, 1] on the device of the model.
 
     Returns:
-    -- A numpy array of dimension (num images, dims) that contains the
-       activations of the given tensor when feeding inception with the
-       query tensor.
+    -- A tensor of dimension (batch size, dims).
     """
-    model.eval()
+    with torch.no_grad():
+        pred = model(batch)[0]
+
+    # If model output is not scalar, apply global spatial average pooling.
+    # This happens if you choose a dimensionality not equal 2048.
+    if pred.size(2) != 1 or pred.size(3) != 1:
+        pred = adaptive_avg_pool2d(pred, output_size=(1, 1))
+
+    return pred.squeeze(3).squeeze(2)
+
+
+def get_dataloader(files, batch_size=50, resize=0):
+    """Loads the images as float tensors in [0, 1].
+
+    Params:
+    -- files       : List of image files paths
+    -- batch_size  : Batch size of images for the model to process at once.
+    -- resize      : resize image to this shape
 
+    Returns:
+    -- A DataLoader over the images in the order of files.
+    """
     if batch_size > len(files):
         print(
             (
@@ -163,28 +181,30 @@ def get_activations(files, model, batch_size=50, dims=2048, device="cpu", resize
         num_workers=4,  # cpu_count(),
         worker_init_fn=set_worker_sharing_strategy,
     )
+    return dataloader
 
-    pred_arr = np.empty((len(files), dims))
-
-    start_idx = 0
-    for batch in tqdm(dataloader):
-        batch = batch.to(device)
-
-        with torch.no_grad():
-            pred = model(batch)[0]
-
-        # If model output is not scalar, apply global spatial average pooling.
-        # This happens if you choose a dimensionality not equal 2048.
-        if pred.size(2) != 1 or pred.size(3) != 1:
-            pred = adaptive_avg_pool2d(pred, output_size=(1, 1))
 
-        pred = pred.squeeze(3).squeeze(2).cpu().numpy()
+def get_activations(files, model, batch_size=50, dims=2048, device="cpu", resize=0):
+    """Calculates the activations of the pool_3 layer batch by batch.
 
-        pred_arr[start_idx : start_idx + pred.shape[0]] = pred
+    Only the activations of the current batch are kept, no array of all
+    activations is built.
 
-        start_idx = start_idx + pred.shape[0]
+    Params:
+    -- files       : List of image files paths
+    -- model       : Instance of inception model
+    -- batch_size  : Batch size of images for the model to process at once.
+    -- dims        : Dimensionality of features returned by Inception
+    -- device      : Device to run calculations
+    -- resize      : resize image to this shape
 
-    return pred_arr
+    Yields:
+    -- A tensor of dimension (batch size, dims) on the device per batch,
+       in the order of files.
+    """
+    model.eval()
+    for batch in tqdm(get_dataloader(files, batch_size, resize)):
+        yield compute_features(model, batch.to(device))
 
 
 def calculate_frechet_distance(mu1, sigma1, mu2, sigma2, eps=1e-6):
@@ -251,6 +271,11 @@ def calculate_activation_statistics(
     files, model, batch_size=50, dims=2048, device="cpu", resize=0
 ):
     """Calculation of the statistics used by the FID.
+
+    Mean and covariance are accumulated batch by batch with the
+    `FeatureStatistics` of the single decode evaluation, memory does not
+    grow with the number of images.
+
     Params:
     -- files       : List of image files paths
     -- model       : Instance of inception model
@@ -267,10 +292,13 @@ def calculate_activation_statistics(
     -- sigma : The covariance matrix of the activations of the pool_3 layer of
                the inception model.
     """
-    act = get_activations(files, model, batch_size, dims, device, resize)
-    mu = np.mean(act, axis=0)
-    sigma = np.cov(act, rowvar=False)
-    return mu, sigma
+    model.eval()
+    statistics = FeatureStatistics(
+        lambda batch: compute_features(model, batch), device=device
+    )
+    for batch in tqdm(get_dataloader(files, batch_size, resize)):
+        statistics.update(batch)
+    return statistics.compute()
 
 
 def compute_statistics_of_path(path, model, batch_size, dims, device, resize=0):
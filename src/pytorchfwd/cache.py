@@ -0,0 +1,313 @@
+"""Caches that let repeated FWD runs skip work done by earlier runs."""
+
+import glob
+import hashlib
+import json
+import os
+from typing import List, Optional, Tuple
+
+import numpy as np
+import torch as th
+from tqdm import tqdm
+
+from .utils import ImagePathDataset
+from .version import VERSION
+
+IMAGE_CACHE_INDEX = "index.json"
+
+
+def is_image_cache(path: str) -> bool:
+    """Check if a path points to a decoded image cache.
+
+    Args:
+        path (str): Path to check.
+
+    Returns:
+        bool: True if the path is an image cache directory.
+    """
+    return os.path.isfile(os.path.join(path, IMAGE_CACHE_INDEX))
+
+
+def cache_images(
+    img_names: List[str],
+    cache_dir: str,
+    batch_size: int,
+    num_workers: Optional[int] = None,
+    decoder: str = "pil",
+    shard_size: int = 4096,
+) -> None:
+    """Decode images once into uint8 .npy shards.
+
+    Shard ``k`` holds the images ``k*shard_size`` to ``(k+1)*shard_size - 1``
+    as an array of shape [images, 3, height, width]. ``index.json`` records
+    the image shape and the name and modification time of every image.
+
+    Args:
+        img_names (List[str]): Image files, all images need the same size.
+        cache_dir (str): Output directory.
+        batch_size (int): Number of images decoded per batch.
+        num_workers (int, optional): Number of loader workers. Defaults to None.
+        decoder (str): Image decoder backend. Defaults to "pil".
+        shard_size (int): Number of images per shard. Defaults to 4096.
+
+    Raises:
+        ValueError: If there are no images.
+    """
+    if not img_names:
+        raise ValueError("No images to cache.")
+    dataset = ImagePathDataset(img_names, decoder=decoder)
+    shape = tuple(dataset.collate([dataset[0]]).shape[1:])
+    dataloader = th.utils.data.DataLoader(
+        dataset,
+        batch_size=batch_size,
+        shuffle=False,
+        drop_last=False,
+        num_workers=num_workers or 0,
+        collate_fn=dataset.collate,
+    )
+    writer = ImageCacheWriter(cache_dir, img_names, shape, shard_size)
+    for img_batch in tqdm(dataloader):
+        writer.write(img_batch)
+    writer.close()
+
+
+class ImageCacheWriter:
+    """Write decoded image batches into the shards of an image cache.
+
+    Used by `cache_images`, and by consumers that decode images anyway and
+    want to keep them for a later pass. Batches have to arrive in the order
+    of `img_names`, the index is written by `close`. With its `update` method
+    the writer also serves as an image accumulator of a single process run,
+    see `pytorchfwd.evaluate`.
+    """
+
+    def __init__(
+        self,
+        cache_dir: str,
+        img_names: List[str],
+        shape: Tuple[int, ...],
+        shard_size: int = 4096,
+    ):
+        """Start an image cache.
+
+        Args:
+            cache_dir (str): Output directory.
+            img_names (List[str]): Image files in the order they are written.
+            shape (Tuple[int, ...]): The [channels, height, width] image shape.
+            shard_size (int): Number of images per shard. Defaults to 4096.
+        """
+        os.makedirs(cache_dir, exist_ok=True)
+        self.cache_dir = cache_dir
+        self.img_names = img_names
+        self.shape = tuple(shape)
+        self.shard_size = shard_size
+        self._shard: Optional[np.memmap] = None
+        self._shard_no, self._position = 0, 0
+
+    def write(self, img_batch: th.Tensor) -> None:
+        """Append a batch of uint8 images, gpu batches are copied to the host.
+
+        Args:
+            img_batch (th.Tensor): Images of shape [batch_size, channels, height, width].
+
+        Raises:
+            ValueError: If the images differ in size from the cache.
+        """
+        if tuple(img_batch.shape[1:]) != self.shape:
+            raise ValueError(f"All images need the shape {self.shape}.")
+        for image in img_batch.cpu().numpy():
+            if self._shard is None:
+                shard_len = min(
+                    self.shard_size,
+                    len(self.img_names) - self._shard_no * self.shard_size,
+                )
+                self._shard = np.lib.format.open_memmap(
+                    _shard_path(self.cache_dir, self._shard_no),
+                    mode="w+",
+                    dtype=np.uint8,
+                    shape=(shard_len,) + self.shape,
+                )
+            self._shard[self._position] = image
+            self._position += 1
+            if self._position == len(self._shard):
+                self._shard.flush()
+                self._shard, self._shard_no, self._position = (
+                    None,
+                    self._shard_no + 1,
+                    0,
+                )
+
+    def update(self, img_batch: th.Tensor) -> None:
+        """Append a batch of uint8 images, see `write`.
+
+        Args:
+            img_batch (th.Tensor): Images of shape [batch_size, channels, height, width].
+        """
+        self.write(img_batch)
+
+    def close(self) -> None:
+        """Write the index, which makes the cache readable."""
+        index = {
+            "shape": list(self.shape),
+            "shard_size": self.shard_size,
+            "files": [[str(name), os.path.getmtime(name)] for name in self.img_names],
+        }
+        with open(os.path.join(self.cache_dir, IMAGE_CACHE_INDEX), "w") as fp:
+            json.dump(index, fp)
+
+
+def _shard_path(cache_dir: str, shard_no: int) -> str:
+    return os.path.join(cache_dir, f"shard_{shard_no:05d}.npy")
+
+
+class ShardedImageDataset(th.utils.data.Dataset):
+    """Dataset reading decoded images from a cache written by `cache_images`.
+
+    Shards are memory mapped, a batch of consecutive images from one shard
+    is returned as a view of the mapped file without decoding or copying.
+    Pass `collate` as `collate_fn` to the DataLoader.
+    """
+
+    def __init__(self, cache_dir: str):
+        """Open an image cache.
+
+        Args:
+            cache_dir (str): Directory written by `cache_images`.
+        """
+        self.cache_dir = cache_dir
+        with open(os.path.join(cache_dir, IMAGE_CACHE_INDEX)) as fp:
+            index = json.load(fp)
+        self.shape = tuple(index["shape"])
+        self.shard_size = index["shard_size"]
+        self.files = [name for name, _ in index["files"]]
+        stale = [
+            name
+            for name, mtime in index["files"]
+            if os.path.exists(name) and os.path.getmtime(name) != mtime
+        ]
+        if stale:
+            print(f"Warning: {len(stale)} images changed since caching {cache_dir}.")
+        self._shards: dict = {}
+
+    def __len__(self):
+        """Length of dataset."""
+        return len(self.files)
+
+    def _get_shard(self, shard_no: int) -> np.ndarray:
+        if shard_no not in self._shards:
+            # copy-on-write keeps the mapped arrays writable for torch.
+            self._shards[shard_no] = np.load(
+                _shard_path(self.cache_dir, shard_no), mmap_mode="c"
+            )
+        return self._shards[shard_no]
+
+    def __getitem__(self, i):
+        """Load the image."""
+        shard_no, offset = divmod(i, self.shard_size)
+        return th.from_numpy(self._get_shard(shard_no)[offset])
+
+    def __getitems__(self, indices: List[int]) -> th.Tensor:
+        """Load a batch of images, consecutive indices are read as one view."""
+        shard_no, offset = divmod(indices[0], self.shard_size)
+        if list(indices) == list(range(indices[0], indices[0] + len(indices))) and (
+            offset + len(indices) <= self.shard_size
+        ):
+            shard = self._get_shard(shard_no)
+            return th.from_numpy(shard[offset : offset + len(indices)])
+        return th.stack([self[i] for i in indices])
+
+    def collate(self, batch: th.Tensor) -> th.Tensor:
+        """Return the batch assembled by `__getitems__`."""
+        return batch
+
+
+def fingerprint(files: List[str], **params) -> str:
+    """Compute a content key for statistics of a list of files.
+
+    The key covers the name, size and modification time of every file,
+    the given parameters and the package version.
+
+    Args:
+        files (List[str]): The files the statistics are computed from.
+        **params: Parameters that influence the statistics,
+            like the wavelet or the decomposition level.
+
+    Returns:
+        str: A hex digest identifying the statistics.
+    """
+    entries = []
+    for name in files:
+        stat = os.stat(name)
+        entries.append([os.path.abspath(name), stat.st_size, stat.st_mtime_ns])
+    description = {
+        "files": entries,
+        "params": {key: str(value) for key, value in sorted(params.items())},
+        "version": VERSION,
+    }
+    return hashlib.sha256(json.dumps(description).encode()).hexdigest()
+
+
+class StatisticsCache:
+    """On disk cache for packet statistics with least recently used eviction.
+
+    Entries are stored as ``<key>.npz`` files. Reading an entry refreshes its
+    modification time, which serves as the recency for eviction whenever the
+    total size of the cache exceeds `max_size`.
+    """
+
+    def __init__(self, cache_dir: str, max_size: int):
+        """Open or create a statistics cache.
+
+        Args:
+            cache_dir (str): Cache directory.
+            max_size (int): Maximum total size of all entries in bytes.
+        """
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _entry_path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.npz")
+
+    def get(self, key: str) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+        """Look up cached statistics.
+
+        Args:
+            key (str): Key computed by `fingerprint`.
+
+        Returns:
+            Optional[Tuple[np.ndarray, np.ndarray]]: Mean and sigma,
+                or None if the key is not cached.
+        """
+        path = self._entry_path(key)
+        if not os.path.exists(path):
+            return None
+        with np.load(path) as fp:
+            mu, sigma = fp["mu"][:], fp["sigma"][:]
+        os.utime(path)
+        return mu, sigma
+
+    def put(self, key: str, mu: np.ndarray, sigma: np.ndarray) -> None:
+        """Store statistics and evict the least recently used entries.
+
+        Args:
+            key (str): Key computed by `fingerprint`.
+            mu (np.ndarray): Packet means.
+            sigma (np.ndarray): Packet covariances.
+        """
+        path = self._entry_path(key)
+        # write to a temporary file first, so readers never see partial entries.
+        tmp_path = f"{path[:-4]}.tmp.npz"
+        np.savez(tmp_path, mu=mu, sigma=sigma)
+        os.replace(tmp_path, path)
+        self._evict()
+
+    def _evict(self) -> None:
+        entries = sorted(
+            glob.glob(os.path.join(self.cache_dir, "*.npz")), key=os.path.getmtime
+        )
+        total = sum(os.path.getsize(entry) for entry in entries)
+        while entries and total > self.max_size:
+            entry = entries.pop(0)
+            total -= os.path.getsize(entry)
+            os.remove(entry)
@@ -0,0 +1,231 @@
+"""FWD, WPKL and feature statistics from a single decode of every image.
+
+Every batch is decoded once and fanned out to the wavelet packet
+statistics, the WPKL packet maxima and, given a feature function, the
+feature statistics of the FID. The WPKL histograms need the maxima of
+both image sets, in single process runs the decoded batches are therefore
+kept in a temporary image cache and read back for the histogram pass
+instead of being decoded again.
+
+The temporary caches hold every image of both paths uncompressed as
+uint8, i.e. images * channels * height * width bytes per path, for
+example about 10 GB for 50k images of 3x256x256. Paths that already are
+image caches, see ``python -m pytorchfwd --cache-images``, are read
+directly and need no temporary copy. Distributed runs decode the images
+again instead, every rank only sees its shard of the images.
+"""
+
+import os
+import tempfile
+from typing import Callable, Dict, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+import torch as th
+import torch.distributed as dist
+
+from .cache import ImageCacheWriter, ShardedImageDataset, is_image_cache
+from .freq_math import RunningStatistics, calculate_frechet_distance
+from .fwd import (
+    _compute_avg_frechet_distance,
+    _compute_dataset_statistics,
+    _get_dataset,
+    _get_device,
+    _get_image_shape,
+    _is_distributed,
+)
+from .utils import ImagePathDataset, _to_float_batch
+from .wpkl import (
+    PacketMaxima,
+    _check_image_counts,
+    _check_image_paths,
+    _compute_histogram_divergence,
+)
+
+METRICS = ("fwd", "wpkl", "fid")
+
+
+class FeatureStatistics:
+    """Mean and covariance of image features, e.g. the InceptionV3 activations of the FID.
+
+    Fed with the decoded uint8 image batches next to the packet transform.
+    """
+
+    def __init__(
+        self,
+        feature_fn: Callable[[th.Tensor], th.Tensor],
+        device: Optional[th.device] = None,
+        dtype: th.dtype = th.float32,
+    ):
+        """Create an empty accumulator.
+
+        Args:
+            feature_fn (Callable[[th.Tensor], th.Tensor]): Maps float images
+                in [0, 1] of shape [batch_size, channels, height, width]
+                to features of shape [batch_size, dim].
+            device (th.device, optional): Device of the images and the
+                statistics. Defaults to None, the cpu.
+            dtype (th.dtype): Precision of the images passed to `feature_fn`.
+                Defaults to th.float32.
+        """
+        self.feature_fn = feature_fn
+        self.dtype = dtype
+        self.statistics = RunningStatistics(device=device)
+
+    def update(self, img_batch: th.Tensor) -> None:
+        """Add the features of an image batch.
+
+        Args:
+            img_batch (th.Tensor): Images of shape [batch_size, channels, height, width].
+        """
+        images = _to_float_batch(img_batch, self.statistics.device, self.dtype)
+        with th.no_grad():
+            features = self.feature_fn(images)
+        # a single feature of dim entries, accumulated in float64.
+        self.statistics.update(features.unsqueeze(1))
+
+    def all_reduce(self, group: Optional[dist.ProcessGroup] = None) -> None:
+        """Combine the statistics of all ranks of a process group.
+
+        Args:
+            group (dist.ProcessGroup, optional): Process group to reduce over.
+                Defaults to the default group.
+        """
+        self.statistics.all_reduce(group)
+
+    def compute(self) -> Tuple[np.ndarray, np.ndarray]:
+        """Return the mean and covariance of all features seen so far.
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray]: Mean of shape [dim] and
+                covariance of shape [dim, dim].
+        """
+        mu, sigma = self.statistics.compute()
+        return mu[0], sigma[0]
+
+
+def evaluate(
+    paths: Sequence[str],
+    wavelet: str,
+    max_level: int,
+    log_scale: bool,
+    batch_size: int,
+    metrics: Sequence[str] = ("fwd", "wpkl"),
+    frechet_backend: str = "torch",
+    dtype: th.dtype = th.float64,
+    feature_fn: Optional[Callable[[th.Tensor], th.Tensor]] = None,
+    tmp_dir: Optional[str] = None,
+) -> Dict[str, float]:
+    """Compute several metrics from one decode of every image.
+
+    Args:
+        paths (Sequence[str]): Image directories or decoded image caches
+            of the real and the generated images.
+        wavelet (str): Choice of wavelet.
+        max_level (int): Decomposition level.
+        log_scale (bool): Apply log scale.
+        batch_size (int): Batch size for packet decomposition.
+        metrics (Sequence[str]): Any of "fwd", "wpkl" and "fid".
+            Defaults to ("fwd", "wpkl").
+        frechet_backend (str): Backend for the packet Frechet distances,
+            one of "scipy", "numpy" or "torch". Defaults to "torch".
+        dtype (th.dtype): Precision of the packet transform.
+            Defaults to th.float64.
+        feature_fn (Callable[[th.Tensor], th.Tensor], optional): Feature
+            extractor of the "fid", see `FeatureStatistics`. Defaults to None.
+        tmp_dir (str, optional): Parent directory of the temporary image
+            caches, which hold all images of both paths as uint8.
+            Defaults to None, the system temporary directory.
+
+    Raises:
+        ValueError: If a metric is unknown or the "fid" lacks a `feature_fn`.
+
+    Returns:
+        Dict[str, float]: The value of every requested metric.
+    """
+    unknown = set(metrics) - set(METRICS)
+    if unknown:
+        raise ValueError(f"Unknown metrics: {sorted(unknown)}")
+    if "fid" in metrics and feature_fn is None:
+        raise ValueError("The fid needs a feature_fn.")
+    paths = list(paths)
+    _check_image_paths(paths)
+    datasets = [_get_dataset(path) for path in paths]
+    if "wpkl" in metrics:
+        _check_image_counts(paths, datasets)
+    device = _get_device()
+    keep_images = "wpkl" in metrics and not _is_distributed()
+
+    with tempfile.TemporaryDirectory(dir=tmp_dir) as cache_root:
+        statistics, features, maxima = [], [], []
+        histogram_datasets: List[Union[ImagePathDataset, ShardedImageDataset]] = []
+        for pos, (path, dataset) in enumerate(zip(paths, datasets)):
+            accumulators: List[PacketMaxima] = []
+            image_accumulators: List[Union[FeatureStatistics, ImageCacheWriter]] = []
+            if "wpkl" in metrics:
+                channels = _get_image_shape(dataset)[0]
+                maxima.append(PacketMaxima((4**max_level, channels), device))
+                accumulators.append(maxima[-1])
+            if "fid" in metrics:
+                features.append(FeatureStatistics(feature_fn, device))
+                image_accumulators.append(features[-1])
+            writer = None
+            if keep_images and not is_image_cache(path):
+                cache_dir = os.path.join(cache_root, str(pos))
+                writer = ImageCacheWriter(
+                    cache_dir,
+                    [str(name) for name in dataset.files],
+                    _get_image_shape(dataset),
+                )
+                image_accumulators.append(writer)
+            print(f"Decoding and evaluating path: {path}")
+            statistics.append(
+                _compute_dataset_statistics(
+                    dataset,
+                    wavelet,
+                    max_level,
+                    log_scale,
+                    batch_size,
+                    dtype,
+                    # without the fwd the packets only feed the accumulators.
+                    packets=None if "fwd" in metrics else slice(0, 0),
+                    accumulators=accumulators,
+                    image_accumulators=image_accumulators,
+                )
+            )
+            if writer is not None:
+                writer.close()
+                histogram_datasets.append(ShardedImageDataset(cache_dir))
+            else:
+                histogram_datasets.append(dataset)
+
+        results = {}
+        if "fwd" in metrics:
+            print("Computing Frechet distances for each packet.")
+            (mu_1, sigma_1), (mu_2, sigma_2) = (
+                packet_statistics.compute(packed=True)
+                for packet_statistics in statistics
+            )
+            results["fwd"] = float(
+                _compute_avg_frechet_distance(
+                    mu_1, mu_2, sigma_1, sigma_2, backend=frechet_backend, packed=True
+                )
+            )
+        if "fid" in metrics:
+            (mu_1, sigma_1), (mu_2, sigma_2) = (
+                feature_statistics.compute() for feature_statistics in features
+            )
+            results["fid"] = float(
+                calculate_frechet_distance(mu_1, sigma_1, mu_2, sigma_2)
+            )
+        if "wpkl" in metrics:
+            results["wpkl"] = _compute_histogram_divergence(
+                paths,
+                histogram_datasets,
+                maxima,
+                wavelet,
+                max_level,
+                log_scale,
+                batch_size,
+                dtype,
+            )
+    return results
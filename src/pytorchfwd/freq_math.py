@@ -1,14 +1,22 @@
 """Wavelet utils."""
 
+import math
+from functools import lru_cache
 from itertools import product
-from typing import Optional
+from typing import TYPE_CHECKING, Dict, Optional, Tuple, Union, overload
 
 import numpy as np
-import ptwt
 import pywt
 import torch
+import torch.distributed as dist
 from scipy import linalg
 
+if TYPE_CHECKING:
+    from .statistics import PacketStatistics
+
+FRECHET_BACKENDS = ("scipy", "numpy", "torch")
+FRECHET_CHUNK_SIZE = 16
+
 
 def get_freq_order(level: int):
     """Get the frequency order for a given packet decomposition level.
@@ -52,6 +60,127 @@ def get_freq_order(level: int):
     return wp_frequency_path, wp_natural_path
 
 
+class WaveletPacketTransform:
+    """Reusable two-dimensional wavelet packet transform.
+
+    The pywt wavelet, the node order and the 2d analysis filters are created
+    once and reused for every batch. Filters are cached per device and dtype.
+    The transform reproduces ``ptwt.WaveletPacket2D`` with reflect padding,
+    the packets are returned in natural order.
+    """
+
+    def __init__(self, wavelet: str, max_level: int, log_scale: bool):
+        """Set up the transform.
+
+        Args:
+            wavelet (str): Choice of wavelet.
+            max_level (int): Level of decomposition.
+            log_scale (bool): Log scale boolean.
+        """
+        self.wavelet = pywt.Wavelet(wavelet)
+        self.max_level = max_level
+        self.log_scale = log_scale
+        self.node_order = [
+            "".join(node) for node in product(["a", "h", "v", "d"], repeat=max_level)
+        ]
+        self._filters: Dict[Tuple[torch.device, torch.dtype], torch.Tensor] = {}
+
+    def get_filters(self, device: torch.device, dtype: torch.dtype) -> torch.Tensor:
+        """Return the 2d analysis filters ordered ll, lh, hl, hh.
+
+        Args:
+            device (torch.device): Device of the filters.
+            dtype (torch.dtype): Data type of the filters.
+
+        Returns:
+            torch.Tensor: Filters of shape [4, 1, filt_len, filt_len].
+        """
+        key = (torch.device(device), dtype)
+        if key not in self._filters:
+            dec_lo = torch.tensor(self.wavelet.dec_lo[::-1], device=device, dtype=dtype)
+            dec_hi = torch.tensor(self.wavelet.dec_hi[::-1], device=device, dtype=dtype)
+            self._filters[key] = torch.stack(
+                [
+                    torch.outer(dec_lo, dec_lo),
+                    torch.outer(dec_hi, dec_lo),
+                    torch.outer(dec_lo, dec_hi),
+                    torch.outer(dec_hi, dec_hi),
+                ]
+            ).unsqueeze(1)
+        return self._filters[key]
+
+    def _pad(self, tensor: torch.Tensor) -> torch.Tensor:
+        """Reflect-pad the last two axes as the padded ptwt transforms do."""
+        pad = (2 * len(self.wavelet) - 3) // 2
+        height, width = tensor.shape[-2:]
+        return torch.nn.functional.pad(
+            tensor,
+            [pad, pad + width % 2, pad, pad + height % 2],
+            mode="reflect",
+        )
+
+    def _dwt2(self, tensor: torch.Tensor) -> torch.Tensor:
+        """Compute a single level 2d wavelet transform.
+
+        Args:
+            tensor (torch.Tensor): Input of shape [N, 1, height, width].
+
+        Returns:
+            torch.Tensor: The a, h, v and d coefficients of shape [N, 4, h, w].
+        """
+        filters = self.get_filters(tensor.device, tensor.dtype)
+        return torch.nn.functional.conv2d(self._pad(tensor), filters, stride=2)
+
+    def __call__(self, tensor: torch.Tensor) -> torch.Tensor:
+        """Compute the wavelet packet transform of a batch.
+
+        All nodes of a level are stacked along the batch axis and transformed
+        by a single convolution, so intermediate levels are never split into
+        separate nodes. The last level comes out ordered by channel and has
+        to be transposed into natural packet order, this copy into the output
+        briefly holds the packets twice.
+
+        Args:
+            tensor (torch.Tensor): Input of shape [batch_size, ..., height, width].
+
+        Returns:
+            torch.Tensor: Packets in natural order of shape
+                [batch_size, packets, ..., packet_height, packet_width].
+        """
+        batch_size, *channel_shape = tensor.shape[:-2]
+        channels = math.prod(channel_shape)
+        coefficients = torch.reshape(tensor, (-1, 1) + tensor.shape[-2:])
+        for _ in range(self.max_level):
+            coefficients = self._dwt2(coefficients)
+            coefficients = torch.reshape(
+                coefficients, (-1, 1) + coefficients.shape[-2:]
+            )
+        packet_shape = tuple(coefficients.shape[-2:])
+        packet_no = len(self.node_order)
+        coefficients = torch.reshape(
+            coefficients, (batch_size, channels, packet_no) + packet_shape
+        )
+        out = torch.empty(
+            (batch_size, packet_no, *channel_shape) + packet_shape,
+            device=tensor.device,
+            dtype=tensor.dtype,
+        )
+        out.view((batch_size, packet_no, channels) + packet_shape).copy_(
+            torch.transpose(coefficients, 1, 2)
+        )
+        if self.log_scale:
+            torch.abs(out, out=out)
+            out.add_(1e-6).log_()
+        return out
+
+
+@lru_cache(maxsize=8)
+def _get_packet_transform(
+    wavelet: str, max_level: int, log_scale: bool
+) -> WaveletPacketTransform:
+    return WaveletPacketTransform(wavelet, max_level, log_scale)
+
+
 def forward_wavelet_packet_transform(
     tensor: torch.Tensor,
     wavelet: str,
@@ -69,19 +198,7 @@ def forward_wavelet_packet_transform(
     Returns:
         torch.Tensor: Packets
     """
-    # ideally the output dtype should depend in the input.
-    # tensor = tensor.type(torch.FloatTensor)
-    packets = ptwt.WaveletPacket2D(tensor, pywt.Wavelet(wavelet), maxlevel=max_level)
-    packet_list = [packets[node] for node in packets.get_natural_order(max_level)]
-
-    # for node in packets.get_natural_order(max_level):
-    # packet = torch.squeeze(packets[node], dim=1)
-    # packet_list.append(packets[node])
-    wp_pt_rs = torch.stack(packet_list, dim=1)
-    if log_scale:
-        wp_pt_rs = torch.log(torch.abs(wp_pt_rs) + 1e-6)
-
-    return wp_pt_rs
+    return _get_packet_transform(wavelet, max_level, log_scale)(tensor)
 
 
 def generate_frequency_packet_image(packet_array: np.ndarray, degree: int):
@@ -127,7 +244,202 @@ def compute_kl_divergence(
     return target * torch.log((target / (output + eps)) + eps)
 
 
-def calculate_frechet_distance(mu1, sigma1, mu2, sigma2, eps=1e-6):
+class RunningStatistics:
+    """Streaming mean and covariance estimates for a stack of features.
+
+    Batches of shape [batch_size, features, dim] are merged one at a time using
+    the pairwise update of Chan et al., so memory stays bounded by the
+    [features, dim, dim] cross-product matrices instead of growing with the
+    number of samples. For the wavelet packet statistics the features axis
+    holds the packets.
+    """
+
+    def __init__(
+        self,
+        device: Optional[torch.device] = None,
+        dtype: torch.dtype = torch.float64,
+        chunk_size: Optional[int] = None,
+    ):
+        """Create an empty accumulator.
+
+        Args:
+            device (torch.device, optional): Device holding the sums.
+                Defaults to the cpu.
+            dtype (torch.dtype): Accumulation precision. Defaults to float64.
+            chunk_size (int, optional): Number of features whose cross-products
+                are updated at once, bounds the temporary memory of `update`.
+                Defaults to None, which updates all features at once.
+        """
+        self.device = device if device is not None else torch.device("cpu")
+        self.dtype = dtype
+        self.chunk_size = chunk_size
+        self.count = 0
+        self.mean: Optional[torch.Tensor] = None
+        self.m2: Optional[torch.Tensor] = None
+
+    @classmethod
+    def from_statistics(
+        cls,
+        count: int,
+        mean: np.ndarray,
+        sigma: np.ndarray,
+        device: Optional[torch.device] = None,
+        dtype: torch.dtype = torch.float64,
+    ) -> "RunningStatistics":
+        """Restore an accumulator from a sample count, mean and covariance.
+
+        Args:
+            count (int): Number of samples the statistics were computed from.
+            mean (np.ndarray): Mean of shape [features, dim].
+            sigma (np.ndarray): Unbiased covariance of shape [features, dim, dim].
+            device (torch.device, optional): Device holding the sums.
+                Defaults to the cpu.
+            dtype (torch.dtype): Accumulation precision. Defaults to float64.
+
+        Returns:
+            RunningStatistics: Accumulator that continues the given statistics.
+        """
+        statistics = cls(device=device, dtype=dtype)
+        if count > 0:
+            statistics.count = int(count)
+            statistics.mean = torch.tensor(mean, device=statistics.device, dtype=dtype)
+            statistics.m2 = torch.tensor(sigma, device=statistics.device, dtype=dtype)
+            statistics.m2 *= count - 1
+        return statistics
+
+    def update(self, batch: torch.Tensor) -> None:
+        """Add a batch of samples.
+
+        Args:
+            batch (torch.Tensor): Samples of shape [batch_size, features, dim].
+        """
+        batch = batch.to(device=self.device)
+        count, features, dim = batch.shape
+        batch_mean = torch.mean(batch, dim=0, dtype=self.dtype)
+        first = self.count == 0
+        if first:
+            self.m2 = torch.empty(
+                (features, dim, dim), device=self.device, dtype=self.dtype
+            )
+        chunk_size = self.chunk_size or features
+        for start in range(0, features, chunk_size):
+            stop = min(start + chunk_size, features)
+            # the subtraction promotes lower precision batches, no separate cast copy.
+            centered = torch.permute(
+                (batch[:, start:stop] - batch_mean[start:stop]).to(self.dtype),
+                (1, 0, 2),
+            )
+            if first:
+                torch.bmm(centered.transpose(1, 2), centered, out=self.m2[start:stop])
+            else:
+                # accumulate in place instead of allocating new [features, dim, dim] sums.
+                self.m2[start:stop].baddbmm_(centered.transpose(1, 2), centered)
+        if first:
+            self.count, self.mean = count, batch_mean
+            return
+        total = self.count + count
+        delta = batch_mean - self.mean
+        self.m2.baddbmm_(
+            delta.unsqueeze(2), delta.unsqueeze(1), alpha=self.count * count / total
+        )
+        self.mean.add_(delta, alpha=count / total)
+        self.count = total
+
+    def merge(self, other: "RunningStatistics") -> None:
+        """Merge the samples seen by another accumulator into this one.
+
+        Args:
+            other (RunningStatistics): Accumulator over disjoint samples.
+        """
+        if other.count == 0:
+            return
+        self._merge(
+            other.count,
+            other.mean.to(device=self.device, dtype=self.dtype),
+            other.m2.to(device=self.device, dtype=self.dtype),
+        )
+
+    def all_reduce(self, group: Optional[dist.ProcessGroup] = None) -> None:
+        """Combine the accumulators of all ranks of a process group.
+
+        Afterwards every rank holds the statistics of the samples seen by
+        all ranks. The global mean is reduced first, then each rank shifts
+        its cross-products to the global mean before they are summed.
+        The reduction runs on the cpu, so it works with the gloo backend.
+
+        Args:
+            group (dist.ProcessGroup, optional): Process group to reduce over.
+                Defaults to the default group.
+        """
+        # ranks without samples still need the feature shape to join the sums.
+        shape = torch.tensor(
+            list(self.mean.shape) if self.count > 0 else [0, 0], dtype=torch.int64
+        )
+        dist.all_reduce(shape, op=dist.ReduceOp.MAX, group=group)
+        features, dim = shape.tolist()
+        if self.count > 0:
+            mean, m2 = self.mean.cpu(), self.m2.cpu()
+        else:
+            mean = torch.zeros(features, dim, dtype=self.dtype)
+            m2 = torch.zeros(features, dim, dim, dtype=self.dtype)
+
+        count = torch.tensor(self.count, dtype=torch.int64)
+        dist.all_reduce(count, group=group)
+        total = int(count)
+        if total == 0:
+            return
+        global_mean = mean * self.count
+        dist.all_reduce(global_mean, group=group)
+        global_mean /= total
+        delta = mean - global_mean
+        m2 = m2 + torch.einsum("pi,pj->pij", delta, delta) * self.count
+        dist.all_reduce(m2, group=group)
+        self.count = total
+        self.mean = global_mean.to(self.device)
+        self.m2 = m2.to(self.device)
+
+    def _merge(self, count: int, mean: torch.Tensor, m2: torch.Tensor) -> None:
+        if self.count == 0:
+            # copies, the sums are updated in place later on.
+            self.count, self.mean, self.m2 = count, mean.clone(), m2.clone()
+            return
+        total = self.count + count
+        delta = mean - self.mean
+        self.m2.add_(m2)
+        self.m2.baddbmm_(
+            delta.unsqueeze(2), delta.unsqueeze(1), alpha=self.count * count / total
+        )
+        self.mean.add_(delta, alpha=count / total)
+        self.count = total
+
+    def compute(self, packed: bool = False) -> Tuple[np.ndarray, np.ndarray]:
+        """Return the mean and unbiased covariance of all samples seen so far.
+
+        Args:
+            packed (bool): Return only the upper triangles of the covariances,
+                see `pack_symmetric`. Defaults to False.
+
+        Raises:
+            ValueError: If no samples have been added.
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray]: Mean of shape [features, dim] and
+                covariance of shape [features, dim, dim], or
+                [features, dim * (dim + 1) / 2] if packed.
+        """
+        if self.count == 0:
+            raise ValueError("Cannot compute statistics without samples.")
+        # pack and divide on the host, the device never holds a second
+        # covariance stack.
+        m2 = self.m2.cpu().numpy()
+        sigma = (pack_symmetric(m2) if packed else m2) / (self.count - 1)
+        # copy, on the cpu the mean would share memory with the running sum.
+        return self.mean.cpu().numpy().copy(), sigma
+
+
+def calculate_frechet_distance(
+    mu1, sigma1, mu2, sigma2, eps=1e-6, mode="sqrtm", sqrt_sigma1=None
+):
     """Frechet Distance Implementation from https://github.com/bioinf-jku/TTUR/blob/master/fid.py.
 
     Numpy implementation of the Frechet Distance.
@@ -146,9 +458,15 @@ def calculate_frechet_distance(mu1, sigma1, mu2, sigma2, eps=1e-6):
     -- sigma1: The covariance matrix over activations for generated samples.
     -- sigma2: The covariance matrix over activations, precalculated on an
                representative data set.
+    -- mode  : "sqrtm" computes the full matrix square root of C_1*C_2 and
+               serves as reference. "eigh" only computes Tr(sqrt(C_1*C_2))
+               from the real eigenvalues of sqrt(C_1)*C_2*sqrt(C_1).
+    -- sqrt_sigma1: Optional precomputed square root of sigma1,
+               only used by the "eigh" mode.
 
     Raises:
-        ValueError: Value error if imaginary component has large value.
+        ValueError: Value error if imaginary component has large value
+            or if the mode is unknown.
 
     Returns:
     --   : The Frechet Distance.
@@ -168,6 +486,14 @@ def calculate_frechet_distance(mu1, sigma1, mu2, sigma2, eps=1e-6):
 
     diff = mu1 - mu2
 
+    if mode == "eigh":
+        if sqrt_sigma1 is None:
+            sqrt_sigma1 = symmetric_sqrt(sigma1)
+        tr_covmean = _trace_sqrt_product(sqrt_sigma1, sigma2)
+        return diff.dot(diff) + np.trace(sigma1) + np.trace(sigma2) - 2 * tr_covmean
+    elif mode != "sqrtm":
+        raise ValueError(f"Unknown Frechet distance mode: {mode}")
+
     # Product might be almost singular
     covmean = linalg.sqrtm(sigma1.dot(sigma2))
     if not np.isfinite(covmean).all():
@@ -189,3 +515,272 @@ def calculate_frechet_distance(mu1, sigma1, mu2, sigma2, eps=1e-6):
     tr_covmean = np.trace(covmean)
 
     return diff.dot(diff) + np.trace(sigma1) + np.trace(sigma2) - 2 * tr_covmean
+
+
+@overload
+def symmetric_sqrt(sigma: np.ndarray) -> np.ndarray: ...
+
+
+@overload
+def symmetric_sqrt(sigma: torch.Tensor) -> torch.Tensor: ...
+
+
+def symmetric_sqrt(
+    sigma: Union[np.ndarray, torch.Tensor],
+) -> Union[np.ndarray, torch.Tensor]:
+    """Compute the square roots of a stack of symmetric psd matrices.
+
+    Args:
+        sigma (np.ndarray or torch.Tensor): Matrices of shape [..., dim, dim].
+
+    Returns:
+        np.ndarray or torch.Tensor: The matrix square roots, negative
+            eigenvalues caused by round-off are clipped to zero.
+    """
+    if isinstance(sigma, torch.Tensor):
+        evals, evecs = torch.linalg.eigh(sigma)
+        evals = torch.sqrt(torch.clamp(evals, min=0))
+        return torch.matmul(evecs * evals.unsqueeze(-2), evecs.transpose(-1, -2))
+    evals, evecs = np.linalg.eigh(sigma)
+    evals = np.sqrt(np.clip(evals, 0, None))
+    return np.matmul(evecs * evals[..., None, :], np.swapaxes(evecs, -1, -2))
+
+
+@overload
+def pack_symmetric(sigma: np.ndarray) -> np.ndarray: ...
+
+
+@overload
+def pack_symmetric(sigma: torch.Tensor) -> torch.Tensor: ...
+
+
+def pack_symmetric(
+    sigma: Union[np.ndarray, torch.Tensor],
+) -> Union[np.ndarray, torch.Tensor]:
+    """Keep only the upper triangles of a stack of symmetric matrices.
+
+    Args:
+        sigma (np.ndarray or torch.Tensor): Matrices of shape [..., dim, dim].
+
+    Returns:
+        np.ndarray or torch.Tensor: Upper triangles, row by row, of shape
+            [..., dim * (dim + 1) / 2].
+    """
+    dim = sigma.shape[-1]
+    if isinstance(sigma, torch.Tensor):
+        rows, cols = torch.triu_indices(dim, dim, device=sigma.device)
+    else:
+        rows, cols = np.triu_indices(dim)
+    return sigma[..., rows, cols]
+
+
+@overload
+def unpack_symmetric(packed: np.ndarray) -> np.ndarray: ...
+
+
+@overload
+def unpack_symmetric(packed: torch.Tensor) -> torch.Tensor: ...
+
+
+def unpack_symmetric(
+    packed: Union[np.ndarray, torch.Tensor],
+) -> Union[np.ndarray, torch.Tensor]:
+    """Restore symmetric matrices from their upper triangles.
+
+    Args:
+        packed (np.ndarray or torch.Tensor): Upper triangles of shape
+            [..., dim * (dim + 1) / 2] as returned by `pack_symmetric`.
+
+    Returns:
+        np.ndarray or torch.Tensor: Matrices of shape [..., dim, dim].
+    """
+    dim = (math.isqrt(8 * packed.shape[-1] + 1) - 1) // 2
+    shape = packed.shape[:-1] + (dim, dim)
+    if isinstance(packed, torch.Tensor):
+        rows_t, cols_t = torch.triu_indices(dim, dim, device=packed.device)
+        sigma_t = packed.new_empty(shape)
+        sigma_t[..., rows_t, cols_t] = packed
+        sigma_t[..., cols_t, rows_t] = packed
+        return sigma_t
+    rows, cols = np.triu_indices(dim)
+    sigma = np.empty(shape, dtype=packed.dtype)
+    sigma[..., rows, cols] = packed
+    sigma[..., cols, rows] = packed
+    return sigma
+
+
+@overload
+def _trace_sqrt_product(sqrt_sigma1: np.ndarray, sigma2: np.ndarray) -> np.ndarray: ...
+
+
+@overload
+def _trace_sqrt_product(
+    sqrt_sigma1: torch.Tensor, sigma2: torch.Tensor
+) -> torch.Tensor: ...
+
+
+def _trace_sqrt_product(
+    sqrt_sigma1: Union[np.ndarray, torch.Tensor],
+    sigma2: Union[np.ndarray, torch.Tensor],
+) -> Union[np.ndarray, torch.Tensor]:
+    """Compute Tr(sqrt(C_1*C_2)) from the eigenvalues of sqrt(C_1)*C_2*sqrt(C_1).
+
+    Both products share their eigenvalues, but the second one is symmetric
+    and psd, which allows a real symmetric eigensolver.
+
+    Args:
+        sqrt_sigma1 (np.ndarray or torch.Tensor): Square roots of the first
+            covariances of shape [..., dim, dim].
+        sigma2 (np.ndarray or torch.Tensor): Second covariances
+            of shape [..., dim, dim].
+
+    Returns:
+        np.ndarray or torch.Tensor: The traces of shape [...].
+    """
+    if isinstance(sqrt_sigma1, torch.Tensor) and isinstance(sigma2, torch.Tensor):
+        product = torch.matmul(torch.matmul(sqrt_sigma1, sigma2), sqrt_sigma1)
+        product = (product + product.transpose(-1, -2)) / 2
+        evals = torch.linalg.eigvalsh(product)
+        return torch.sum(torch.sqrt(torch.clamp(evals, min=0)), dim=-1)
+    product = np.matmul(np.matmul(sqrt_sigma1, sigma2), sqrt_sigma1)
+    product = (product + np.swapaxes(product, -1, -2)) / 2
+    evals = np.linalg.eigvalsh(product)
+    return np.sum(np.sqrt(np.clip(evals, 0, None)), axis=-1)
+
+
+def calculate_frechet_distances(
+    mu1: np.ndarray,
+    sigma1: Union[np.ndarray, "PacketStatistics"],
+    mu2: np.ndarray,
+    sigma2: Union[np.ndarray, "PacketStatistics"],
+    backend: str = "torch",
+    device: Optional[torch.device] = None,
+    sqrt_sigma1: Optional[np.ndarray] = None,
+    packed: bool = False,
+    chunk_size: Optional[int] = None,
+) -> np.ndarray:
+    """Compute the Frechet distances of a stack of Gaussians at once.
+
+    The "scipy" backend calls `calculate_frechet_distance` for every entry.
+    The "numpy" and "torch" backends process the whole stack with batched
+    symmetric eigendecompositions and reuse `sqrt_sigma1` if it is given.
+    With `chunk_size` the stack is processed that many packets at a time.
+    Packed covariances are always processed in chunks and only the
+    covariances of the current chunk are unpacked. The same holds for
+    saved `PacketStatistics`, only the current chunk is read and upcast.
+
+    Args:
+        mu1 (np.ndarray): Means of shape [packets, dim].
+        sigma1 (Union[np.ndarray, PacketStatistics]): Covariances of shape
+            [packets, dim, dim], or saved statistics to read them from.
+        mu2 (np.ndarray): Means of shape [packets, dim].
+        sigma2 (Union[np.ndarray, PacketStatistics]): Covariances of shape
+            [packets, dim, dim], or saved statistics to read them from.
+        backend (str): One of "scipy", "numpy" or "torch". Defaults to "torch".
+        device (torch.device, optional): Device used by the torch backend.
+            Defaults to the cpu.
+        sqrt_sigma1 (np.ndarray, optional): Precomputed matrix square roots
+            of sigma1. Defaults to None.
+        packed (bool): The covariance arrays are upper triangles of shape
+            [packets, dim * (dim + 1) / 2]. Defaults to False.
+        chunk_size (int, optional): Number of packets processed at once.
+            Defaults to None, which is `FRECHET_CHUNK_SIZE` for packed or
+            saved covariances and all packets otherwise.
+
+    Raises:
+        ValueError: If the backend is unknown.
+
+    Returns:
+        np.ndarray: The Frechet distance for each packet.
+    """
+    assert mu1.shape == mu2.shape, "Mean stacks have different shapes"
+    if not isinstance(sigma1, np.ndarray) or not isinstance(sigma2, np.ndarray):
+        # saved statistics are always read one chunk at a time.
+        assert len(sigma1) == len(sigma2), "Covariance stacks have different lengths"
+        return _chunked_frechet_distances(
+            mu1, sigma1, mu2, sigma2, backend, device, sqrt_sigma1, packed, chunk_size
+        )
+    assert sigma1.shape == sigma2.shape, "Covariance stacks have different shapes"
+    if packed or (chunk_size is not None and chunk_size < len(mu1)):
+        return _chunked_frechet_distances(
+            mu1, sigma1, mu2, sigma2, backend, device, sqrt_sigma1, packed, chunk_size
+        )
+    if backend == "scipy":
+        return np.array(
+            [
+                calculate_frechet_distance(mu1[p], sigma1[p], mu2[p], sigma2[p])
+                for p in range(len(mu1))
+            ]
+        )
+    elif backend == "numpy":
+        diff = mu1 - mu2
+        if sqrt_sigma1 is None:
+            sqrt_sigma1 = symmetric_sqrt(sigma1)
+        tr_covmean = _trace_sqrt_product(sqrt_sigma1, sigma2)
+        return (
+            np.sum(diff * diff, axis=-1)
+            + np.trace(sigma1, axis1=-2, axis2=-1)
+            + np.trace(sigma2, axis1=-2, axis2=-1)
+            - 2 * tr_covmean
+        )
+    elif backend == "torch":
+        mu1_t, sigma1_t, mu2_t, sigma2_t = (
+            torch.as_tensor(array, dtype=torch.float64, device=device)
+            for array in (mu1, sigma1, mu2, sigma2)
+        )
+        diff_t = mu1_t - mu2_t
+        if sqrt_sigma1 is None:
+            sqrt_sigma1_t = symmetric_sqrt(sigma1_t)
+        else:
+            sqrt_sigma1_t = torch.as_tensor(
+                sqrt_sigma1, dtype=torch.float64, device=device
+            )
+        tr_covmean_t = _trace_sqrt_product(sqrt_sigma1_t, sigma2_t)
+        distances_t = (
+            torch.sum(diff_t * diff_t, dim=-1)
+            + torch.diagonal(sigma1_t, dim1=-2, dim2=-1).sum(-1)
+            + torch.diagonal(sigma2_t, dim1=-2, dim2=-1).sum(-1)
+            - 2 * tr_covmean_t
+        )
+        return distances_t.cpu().numpy()
+    raise ValueError(f"Unknown Frechet distance backend: {backend}")
+
+
+def _chunked_frechet_distances(
+    mu1: np.ndarray,
+    sigma1: Union[np.ndarray, "PacketStatistics"],
+    mu2: np.ndarray,
+    sigma2: Union[np.ndarray, "PacketStatistics"],
+    backend: str,
+    device: Optional[torch.device],
+    sqrt_sigma1: Optional[np.ndarray],
+    packed: bool,
+    chunk_size: Optional[int],
+) -> np.ndarray:
+    """Compute the Frechet distances chunk by chunk, see `calculate_frechet_distances`."""
+    chunk_size = chunk_size if chunk_size is not None else FRECHET_CHUNK_SIZE
+    distances = []
+    for start in range(0, len(mu1), chunk_size):
+        chunk = slice(start, start + chunk_size)
+        distances.append(
+            calculate_frechet_distances(
+                mu1[chunk],
+                _read_sigma_chunk(sigma1, chunk, packed),
+                mu2[chunk],
+                _read_sigma_chunk(sigma2, chunk, packed),
+                backend=backend,
+                device=device,
+                sqrt_sigma1=None if sqrt_sigma1 is None else sqrt_sigma1[chunk],
+            )
+        )
+    return np.concatenate(distances)
+
+
+def _read_sigma_chunk(
+    sigma: Union[np.ndarray, "PacketStatistics"], chunk: slice, packed: bool
+) -> np.ndarray:
+    """Return the dense covariances of a chunk of packets."""
+    if not isinstance(sigma, np.ndarray):
+        # saved statistics, only this chunk is read from disk and upcast.
+        return sigma.get_sigma(chunk)
+    return unpack_symmetric(sigma[chunk]) if packed else sigma[chunk]
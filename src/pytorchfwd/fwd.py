@@ -1,176 +1,924 @@
 """Frechet Wavelet Distance computation."""
 
+import glob
 import os
 import pathlib
-from typing import List, Tuple
+from typing import Callable, Iterable, Iterator, List, Optional, Sequence, Tuple, Union
 
 import numpy as np
 import torch as th
-import torchvision.transforms as tv
+import torch.distributed as dist
 from tqdm import tqdm
 
-from .freq_math import calculate_frechet_distance, forward_wavelet_packet_transform
-from .utils import ImagePathDataset, _parse_args
-
-th.set_default_dtype(th.float64)
-
+from .cache import (
+    ShardedImageDataset,
+    StatisticsCache,
+    cache_images,
+    fingerprint,
+    is_image_cache,
+)
+from .freq_math import (
+    FRECHET_CHUNK_SIZE,
+    RunningStatistics,
+    WaveletPacketTransform,
+    calculate_frechet_distances,
+    pack_symmetric,
+    symmetric_sqrt,
+    unpack_symmetric,
+)
+from .memory import MemoryPlan, plan_histogram_batch_size, plan_memory
+from .statistics import (
+    STATS_META,
+    PacketStatistics,
+    is_statistics_dir,
+    is_statistics_path,
+)
+from .utils import (
+    ImagePathDataset,
+    StageTimer,
+    _format_size,
+    _parse_args,
+    _to_float_batch,
+)
 
 IMAGE_EXTS = {"jpg", "jpeg", "png"}
 NUM_PROCESSES = None
+DECODER = "pil"
+STATS_CACHE: Optional[StatisticsCache] = None
+TIMING = False
+MAX_MEMORY: Optional[int] = None
+PRECISIONS = {"float32": th.float32, "float64": th.float64}
 
 
 def compute_packet_statistics(
-    dataloader: th.utils.data.DataLoader, wavelet: str, max_level: int, log_scale: bool
+    dataloader: th.utils.data.DataLoader,
+    wavelet: str,
+    max_level: int,
+    log_scale: bool,
+    dtype: th.dtype = th.float64,
+    packed: bool = False,
 ) -> Tuple[np.ndarray, ...]:
     """Compute wavelet packet transform across batches.
 
+    Packet means and covariances are accumulated batch by batch, so the
+    packets of the whole dataset are never held in memory at once.
+    The packet transform runs in `dtype`, the statistics are always
+    accumulated in float64.
+
     Args:
         dataloader (th.utils.data.DataLoader): Torch dataloader.
         wavelet (str): Choice of wavelet.
         max_level (int): Wavelet decomposition level.
         log_scale (bool): Apply log scale.
+        dtype (th.dtype): Precision of the packet transform.
+            Defaults to th.float64.
+        packed (bool): Return only the upper triangles of sigma,
+            see `pack_symmetric`. Defaults to False.
 
     Returns:
         Tuple[np.ndarray, ...]: Mean and sigma for each packet.
     """
-    packets = []
-    device = th.device("cuda:0") if th.cuda.is_available() else th.device("cpu")
-    for img_batch in tqdm(dataloader):
-        if isinstance(img_batch, list):
-            img_batch = img_batch[0]
-        img_batch = img_batch.to(device)
-        packets.append(
-            forward_wavelet_packet_transform(
-                img_batch, wavelet, max_level, log_scale
-            ).cpu()
-        )
-    packet_tensor = th.cat(packets, dim=0)
-    packet_tensor = th.permute(packet_tensor, (1, 0, 2, 3, 4))
-    P, BS, C, H, W = packet_tensor.shape
-    packet_tensor = th.reshape(packet_tensor, (P, BS, C * H * W))
-    print("Computing mean and std for each packet.")
-    mu = th.mean(packet_tensor, dim=1).numpy()
-
-    def gpu_cov(tensor_):
-        return th.cov(tensor_.T).cpu()
-
-    sigma = th.stack(
-        [gpu_cov(packet_tensor[p, :, :].to(device)) for p in range(P)], dim=0
-    ).numpy()
-    return mu, sigma
+    return _accumulate_packet_statistics(
+        dataloader, wavelet, max_level, log_scale, dtype
+    ).compute(packed=packed)
+
+
+def _accumulate_packet_statistics(
+    dataloader: th.utils.data.DataLoader,
+    wavelet: str,
+    max_level: int,
+    log_scale: bool,
+    dtype: th.dtype,
+    packet_chunk: Optional[int] = None,
+    packets: Optional[slice] = None,
+    accumulators: Sequence = (),
+    image_accumulators: Sequence = (),
+) -> RunningStatistics:
+    """Accumulate the packet statistics of all batches of a dataloader."""
+    device = _get_device()
+    statistics = RunningStatistics(device=device, chunk_size=packet_chunk)
+    transform = WaveletPacketTransform(wavelet, max_level, log_scale)
+    timer = StageTimer(enabled=TIMING, device=device)
+    batches = (
+        img_batch[0] if isinstance(img_batch, list) else img_batch
+        for img_batch in dataloader
+    )
+    for img_batch in tqdm(
+        timer.iterate("load", _prefetch(batches, device)), total=len(dataloader)
+    ):
+        _update_packet_statistics(
+            statistics,
+            img_batch,
+            transform,
+            dtype,
+            timer,
+            packets,
+            accumulators,
+            image_accumulators,
+        )
+    if TIMING:
+        print(f"Timing: {timer.summary()}")
+    return statistics
+
+
+def _prefetch(batches: Iterable[th.Tensor], device: th.device) -> Iterator[th.Tensor]:
+    """Copy the next batch to the gpu while the current batch is processed.
+
+    The copies run on a side stream, batches from a pinned memory dataloader
+    are transferred asynchronously. On the cpu the batches are passed through.
+
+    Args:
+        batches (Iterable[th.Tensor]): Image batches on the host.
+        device (th.device): Device the batches are processed on.
+
+    Yields:
+        Iterator[th.Tensor]: The batches, on the gpu already moved to `device`.
+    """
+    if device.type != "cuda":
+        yield from batches
+        return
+    stream = th.cuda.Stream(device)
+    pending = None
+    for img_batch in batches:
+        with th.cuda.stream(stream):
+            next_batch = img_batch.to(device, non_blocking=True)
+        if pending is not None:
+            yield pending
+        th.cuda.current_stream(device).wait_stream(stream)
+        # the batch is used on the compute stream, keep its memory until then.
+        next_batch.record_stream(th.cuda.current_stream(device))
+        pending = next_batch
+    if pending is not None:
+        yield pending
+
+
+def _update_packet_statistics(
+    statistics: RunningStatistics,
+    img_batch: th.Tensor,
+    transform: WaveletPacketTransform,
+    dtype: th.dtype,
+    timer: Optional[StageTimer] = None,
+    packets: Optional[slice] = None,
+    accumulators: Sequence = (),
+    image_accumulators: Sequence = (),
+) -> None:
+    """Transform an image batch and add its packets, or a range of them, to the statistics."""
+    timer = timer if timer is not None else StageTimer(enabled=False)
+    with timer.stage("transform"):
+        packet_batch = transform(_to_float_batch(img_batch, statistics.device, dtype))
+    with timer.stage("accumulate"):
+        # image accumulators, like the FID features, see the decoded images.
+        for accumulator in image_accumulators:
+            accumulator.update(img_batch)
+        # further accumulators, like the WPKL maxima, see all packets unflattened.
+        for accumulator in accumulators:
+            accumulator.update(packet_batch)
+        if packets is not None:
+            packet_batch = packet_batch[:, packets]
+        if packet_batch.shape[1] > 0:
+            statistics.update(th.flatten(packet_batch, start_dim=2))
 
 
 def calculate_path_statistics(
-    path: str, wavelet: str, max_level: int, log_scale: bool, batch_size: int
-) -> Tuple[np.ndarray, ...]:
+    path: str,
+    wavelet: str,
+    max_level: int,
+    log_scale: bool,
+    batch_size: int,
+    dtype: th.dtype = th.float64,
+    packed: bool = False,
+) -> Tuple[np.ndarray, Union[np.ndarray, PacketStatistics]]:
     """Compute mean and sigma for given path.
 
+    For saved statistics the memory mapped `PacketStatistics` are returned
+    in place of sigma, `calculate_frechet_distances` reads them a chunk of
+    packets at a time instead of loading the whole stack.
+
     Args:
-        path (str): npz path or image directory.
+        path (str): npz path, statistics directory, image directory
+            or decoded image cache.
         wavelet (str): Choice of wavelet.
         max_level (int): Decomposition level.
         log_scale (bool): Apply log scale.
         batch_size (int): Batch size for packet decomposition.
+        dtype (th.dtype): Precision of the packet transform.
+            Defaults to th.float64.
+        packed (bool): Return only the upper triangles of sigma,
+            see `pack_symmetric`. Defaults to False.
 
     Raises:
         ValueError: Error if mu and sigma cannot be calculated.
 
     Returns:
-        Tuple[np.ndarray, ...]: Tuple containing mean and sigma for each packet.
+        Tuple[np.ndarray, Union[np.ndarray, PacketStatistics]]: Tuple
+            containing mean and sigma, or the saved statistics, for each packet.
     """
-    mu, sigma = None, None
-    if path.endswith(".npz") or path.endswith(".npy"):
-        with np.load(path) as fp:
-            mu = fp["mu"][:]
-            sigma = fp["sigma"][:]
+    if is_statistics_path(path):
+        statistics = PacketStatistics.load(path)
+        return statistics.get_mu(), statistics
+
+    mu: Optional[np.ndarray] = None
+    sigma: Optional[np.ndarray] = None
+    dataset = _get_dataset(path)
+    if is_image_cache(path):
+        files = sorted(glob.glob(os.path.join(path, "*")))
     else:
-        posfix_path = pathlib.Path(path)
-        img_names = sorted(
-            [name for ext in IMAGE_EXTS for name in posfix_path.glob(f"*.{ext}")]
-        )
-        dataloader = th.utils.data.DataLoader(
-            ImagePathDataset(img_names, transforms=tv.ToTensor()),
-            batch_size=batch_size,
-            shuffle=False,
-            drop_last=False,
-            num_workers=NUM_PROCESSES,
-        )
-        mu, sigma = compute_packet_statistics(
-            dataloader=dataloader,
+        files = dataset.files
+    if STATS_CACHE is not None:
+        key = fingerprint(
+            files,
             wavelet=wavelet,
             max_level=max_level,
             log_scale=log_scale,
+            dtype=dtype,
+            # decoders may differ slightly, image caches are decoded already.
+            decoder=None if is_image_cache(path) else DECODER,
         )
+        cached = STATS_CACHE.get(key)
+        if cached is not None:
+            print(f"Using cached statistics for path: {path}")
+            mu, sigma = cached
+            # entries keep the layout they were computed with.
+            if packed and sigma.ndim == 3:
+                sigma = pack_symmetric(sigma)
+            elif not packed and sigma.ndim == 2:
+                sigma = unpack_symmetric(sigma)
+            return mu, sigma
+    mu, sigma = _compute_dataset_statistics(
+        dataset, wavelet, max_level, log_scale, batch_size, dtype
+    ).compute(packed=packed)
+    if STATS_CACHE is not None and _is_main_process():
+        STATS_CACHE.put(key, mu, sigma)
 
     if (mu is None) or (sigma is None):
         raise ValueError(f"The file path: {path} is empty/doesn't have statistics.")
     return mu, sigma
 
 
-def _compute_avg_frechet_distance(mu1, mu2, sigma1, sigma2):
+def _get_image_names(path: str) -> List[pathlib.Path]:
+    """List the images of a directory in sorted order."""
+    posfix_path = pathlib.Path(path)
+    return sorted([name for ext in IMAGE_EXTS for name in posfix_path.glob(f"*.{ext}")])
+
+
+def _get_dataset(path: str) -> Union[ImagePathDataset, ShardedImageDataset]:
+    """Open an image directory or a decoded image cache."""
+    if is_image_cache(path):
+        return ShardedImageDataset(path)
+    return ImagePathDataset(_get_image_names(path), decoder=DECODER)
+
+
+def _compute_dataset_statistics(
+    dataset: Union[ImagePathDataset, ShardedImageDataset],
+    wavelet: str,
+    max_level: int,
+    log_scale: bool,
+    batch_size: int,
+    dtype: th.dtype,
+    packets: Optional[slice] = None,
+    accumulators: Sequence = (),
+    image_accumulators: Sequence = (),
+) -> RunningStatistics:
+    """Accumulate the packet statistics of a dataset.
+
+    In a distributed run every rank processes a contiguous shard of the
+    dataset and the partial statistics are all-reduced, so all ranks
+    return the statistics of the whole dataset.
+
+    Args:
+        dataset (Union[ImagePathDataset, ShardedImageDataset]): Images with a `collate` method.
+        wavelet (str): Choice of wavelet.
+        max_level (int): Decomposition level.
+        log_scale (bool): Apply log scale.
+        batch_size (int): Batch size for packet decomposition.
+        dtype (th.dtype): Precision of the packet transform.
+        packets (slice, optional): Range of packets to accumulate, an
+            empty range only feeds the accumulators.
+            Defaults to None, which accumulates all packets.
+        accumulators (Sequence): Further accumulators fed from the same
+            packet transform, with `update` and `all_reduce` methods like
+            `RunningStatistics`. Defaults to ().
+        image_accumulators (Sequence): Accumulators fed with the decoded
+            uint8 image batches on the device, with `update` and
+            `all_reduce` methods. Defaults to ().
+
+    Returns:
+        RunningStatistics: The accumulated packet statistics.
+    """
+    packet_chunk = None
+    if MAX_MEMORY is not None and len(dataset) > 0:
+        packet_no = 4**max_level
+        packets_per_pass = len(range(packet_no)[packets or slice(None)])
+        plan = plan_memory(
+            _get_image_shape(dataset),
+            wavelet,
+            max_level,
+            MAX_MEMORY,
+            batch_size,
+            dtype,
+            packets_per_pass=packets_per_pass,
+        )
+        batch_size, packet_chunk = plan.batch_size, plan.packet_chunk
+        print(
+            f"Memory plan: batch size {batch_size}, {packet_chunk} packets per update, "
+            f"estimated {_format_size(plan.estimate['total'])} "
+            f"of {_format_size(MAX_MEMORY)}."
+        )
+    statistics = _accumulate_packet_statistics(
+        _get_dataloader(dataset, batch_size),
+        wavelet,
+        max_level,
+        log_scale,
+        dtype,
+        packet_chunk,
+        packets,
+        accumulators,
+        image_accumulators,
+    )
+    if _is_distributed():
+        statistics.all_reduce()
+        for accumulator in [*accumulators, *image_accumulators]:
+            accumulator.all_reduce()
+    return statistics
+
+
+def _plan_histogram_batch_size(
+    dataset: Union[ImagePathDataset, ShardedImageDataset],
+    wavelet: str,
+    max_level: int,
+    batch_size: int,
+    dtype: th.dtype,
+) -> int:
+    """Limit the batch size of the WPKL passes to the memory budget, if one is set."""
+    if MAX_MEMORY is None or len(dataset) == 0:
+        return batch_size
+    planned = plan_histogram_batch_size(
+        _get_image_shape(dataset), wavelet, max_level, MAX_MEMORY, batch_size, dtype
+    )
+    if planned < batch_size:
+        print(f"Memory plan: batch size {planned} for the WPKL passes.")
+    return planned
+
+
+def _get_dataloader(
+    dataset: Union[ImagePathDataset, ShardedImageDataset], batch_size: int
+) -> th.utils.data.DataLoader:
+    """Load a dataset in order, in a distributed run only the shard of this rank.
+
+    Args:
+        dataset (Union[ImagePathDataset, ShardedImageDataset]): Images with a `collate` method.
+        batch_size (int): Number of images per batch.
+
+    Returns:
+        th.utils.data.DataLoader: Loader returning pinned batches if a gpu is available.
+    """
+    collate: Optional[Callable] = dataset.collate
+    shard: th.utils.data.Dataset = dataset
+    if _is_distributed():
+        rank, world_size = dist.get_rank(), dist.get_world_size()
+        start = len(dataset) * rank // world_size
+        stop = len(dataset) * (rank + 1) // world_size
+        shard = th.utils.data.Subset(dataset, range(start, stop))
+    return th.utils.data.DataLoader(
+        shard,
+        batch_size=batch_size,
+        shuffle=False,
+        drop_last=False,
+        num_workers=NUM_PROCESSES,
+        collate_fn=collate,
+        pin_memory=th.cuda.is_available(),
+    )
+
+
+def _get_image_shape(
+    dataset: Union[ImagePathDataset, ShardedImageDataset],
+) -> Tuple[int, int, int]:
+    """Return the [channels, height, width] shape of the images of a dataset."""
+    if isinstance(dataset, ShardedImageDataset):
+        channels, height, width = dataset.shape
+    else:
+        channels, height, width = dataset.collate([dataset[0]]).shape[1:]
+    return channels, height, width
+
+
+def _is_distributed() -> bool:
+    """Check if this process is one of several torch.distributed ranks."""
+    return dist.is_initialized() and dist.get_world_size() > 1
+
+
+def _is_main_process() -> bool:
+    """Check if this process writes results, i.e. is rank 0 or not distributed."""
+    return not dist.is_initialized() or dist.get_rank() == 0
+
+
+def _get_device() -> th.device:
+    """Pick the device of this process, distributed ranks share the gpus round robin."""
+    if not th.cuda.is_available():
+        return th.device("cpu")
+    if dist.is_initialized():
+        return th.device(f"cuda:{dist.get_rank() % th.cuda.device_count()}")
+    return th.device("cuda:0")
+
+
+class ReferenceStatistics:
+    """Reference packet statistics for repeated FWD scoring.
+
+    The matrix square roots of the reference covariances are computed once
+    and reused by every subsequent distance computation. For statistics
+    loaded from a file they are also stored next to it as
+    ``<name>_sqrt_sigma.npy`` and reloaded as long as that file is newer.
+    """
+
+    def __init__(
+        self, mu: np.ndarray, sigma: np.ndarray, cache_path: Optional[str] = None
+    ):
+        """Wrap precomputed reference statistics.
+
+        Args:
+            mu (np.ndarray): Packet means of shape [packets, dim].
+            sigma (np.ndarray): Packet covariances of shape [packets, dim, dim].
+            cache_path (str, optional): Where to cache the covariance square
+                roots on disk. Defaults to None, which keeps them in memory only.
+        """
+        self.mu = mu
+        self.sigma = sigma
+        self.cache_path = cache_path
+        self._sqrt_sigma: Optional[np.ndarray] = None
+
+    @classmethod
+    def from_path(
+        cls,
+        path: str,
+        wavelet: str,
+        max_level: int,
+        log_scale: bool,
+        batch_size: int,
+        cache: bool = True,
+        dtype: th.dtype = th.float64,
+    ) -> "ReferenceStatistics":
+        """Load or compute the reference statistics for a path.
+
+        Args:
+            path (str): npz path, statistics directory or image directory.
+            wavelet (str): Choice of wavelet.
+            max_level (int): Decomposition level.
+            log_scale (bool): Apply log scale.
+            batch_size (int): Batch size for packet decomposition.
+            cache (bool): Cache the square roots next to an npz file
+                or inside a statistics directory.
+                Defaults to True.
+            dtype (th.dtype): Precision of the packet transform.
+                Defaults to th.float64.
+
+        Returns:
+            ReferenceStatistics: The reference statistics.
+        """
+        mu, sigma = calculate_path_statistics(
+            path, wavelet, max_level, log_scale, batch_size, dtype
+        )
+        if isinstance(sigma, PacketStatistics):
+            # the square roots cover all packets, the reference is read at once.
+            sigma = sigma.get_sigma()
+        cache_path, saved_path = None, path
+        if cache and (path.endswith(".npz") or path.endswith(".npy")):
+            cache_path = f"{path[:-4]}_sqrt_sigma.npy"
+        elif cache and is_statistics_dir(path):
+            cache_path = os.path.join(path, "sqrt_sigma.npy")
+            saved_path = os.path.join(path, STATS_META)
+        if cache_path is not None and os.path.exists(cache_path):
+            if os.path.getmtime(cache_path) < os.path.getmtime(saved_path):
+                os.remove(cache_path)
+        return cls(mu, sigma, cache_path=cache_path)
+
+    @property
+    def sqrt_sigma(self) -> np.ndarray:
+        """Matrix square roots of the reference covariances."""
+        if self._sqrt_sigma is None:
+            if self.cache_path is not None and os.path.exists(self.cache_path):
+                sqrt_sigma = np.load(self.cache_path)
+                if sqrt_sigma.shape == self.sigma.shape:
+                    self._sqrt_sigma = sqrt_sigma
+            if self._sqrt_sigma is None:
+                self._sqrt_sigma = symmetric_sqrt(self.sigma)
+                if self.cache_path is not None:
+                    np.save(self.cache_path, self._sqrt_sigma)
+        return self._sqrt_sigma
+
+    def frechet_distance(
+        self,
+        mu: np.ndarray,
+        sigma: Union[np.ndarray, PacketStatistics],
+        backend: str = "torch",
+        chunk_size: int = FRECHET_CHUNK_SIZE,
+    ) -> float:
+        """Compute the average packet Frechet distance to these statistics.
+
+        Args:
+            mu (np.ndarray): Packet means of the generated images.
+            sigma (Union[np.ndarray, PacketStatistics]): Packet covariances
+                of the generated images, or their saved statistics.
+            backend (str): Either "numpy" or "torch". Defaults to "torch".
+            chunk_size (int): Packets whose distances are computed at once.
+                Defaults to `FRECHET_CHUNK_SIZE`.
+
+        Returns:
+            float: The Frechet Wavelet Distance.
+        """
+        device = _get_device()
+        frechet_distances = calculate_frechet_distances(
+            self.mu,
+            self.sigma,
+            mu,
+            sigma,
+            backend=backend,
+            device=device,
+            sqrt_sigma1=self.sqrt_sigma,
+            # the dense stacks of all packets may not fit on the device at once.
+            chunk_size=chunk_size,
+        )
+        return np.mean(frechet_distances)
+
+
+def _compute_avg_frechet_distance(
+    mu1, mu2, sigma1, sigma2, backend="torch", packed=False, chunk_size=None
+):
     """Compute avg frechet distance over packets."""
-    frechet_distances = []
-    for packet_no in tqdm(range(len(mu1))):
-        fd = calculate_frechet_distance(
-            mu1=mu1[packet_no, :],
-            mu2=mu2[packet_no, :],
-            sigma1=sigma1[packet_no, :, :],
-            sigma2=sigma2[packet_no, :, :],
-        )
-        frechet_distances.append(fd)
+    device = _get_device()
+    frechet_distances = calculate_frechet_distances(
+        mu1,
+        sigma1,
+        mu2,
+        sigma2,
+        backend=backend,
+        device=device,
+        packed=packed,
+        chunk_size=chunk_size,
+    )
     return np.mean(frechet_distances)
 
 
 def compute_fwd(
-    paths: List[str], wavelet: str, max_level: int, log_scale: bool, batch_size: int
+    paths: List[Union[str, ReferenceStatistics]],
+    wavelet: str,
+    max_level: int,
+    log_scale: bool,
+    batch_size: int,
+    frechet_backend: str = "torch",
+    dtype: th.dtype = th.float64,
+    packets_per_pass: Optional[int] = None,
 ) -> float:
     """Compute Frechet Wavelet Distance.
 
+    With `packets_per_pass` the packets are processed in groups. For every
+    group the statistics of both paths and their Frechet distances are
+    computed before the next group starts, so memory is bounded by the
+    group size at the cost of one pass over the images per group.
+    With a memory budget the group size is planned automatically.
+
     Args:
-        paths (List[str]): List containing path of source and generated images.
+        paths (List[Union[str, ReferenceStatistics]]): List containing path of
+            source and generated images. The source may also be given as
+            ReferenceStatistics, which skips all work on the reference side.
         wavelet (str): Choice of wavelet.
         max_level (int): Decomposition level.
         log_scale (bool): Apply log scale.
         batch_size (int): Batch size for packet decomposition.
+        frechet_backend (str): Backend for the Frechet distances,
+            one of "scipy", "numpy" or "torch". Defaults to "torch".
+        dtype (th.dtype): Precision of the packet transform.
+            Defaults to th.float64.
+        packets_per_pass (int, optional): Number of packets processed at once.
+            Defaults to None, which processes all packets at once.
 
     Raises:
         RuntimeError: Error if path doesn't exist.
+        ValueError: If the generated images are given as ReferenceStatistics.
 
     Returns:
         float: Frechet Wavelet Distance.
     """
     for path in paths:
-        if not os.path.exists(path):
+        if isinstance(path, str) and not os.path.exists(path):
             raise RuntimeError(f"Invalid path: {path}")
+    generated = paths[1]
+    if not isinstance(generated, str):
+        raise ValueError("Only the source may be given as ReferenceStatistics.")
 
-    print(f"Computing stats for path: {paths[0]}")
-    mu_1, sigma_1 = calculate_path_statistics(
-        paths[0], wavelet, max_level, log_scale, batch_size
+    frechet_chunk = FRECHET_CHUNK_SIZE
+    plan = _plan_passes(
+        paths,
+        wavelet,
+        max_level,
+        batch_size,
+        frechet_backend,
+        dtype,
+        packets_per_pass,
     )
-    print(f"Computing stats for path: {paths[1]}")
+    if plan is not None:
+        packets_per_pass, frechet_chunk = plan.packets_per_pass, plan.frechet_chunk
+    if packets_per_pass is not None and packets_per_pass < 4**max_level:
+        return _compute_grouped_fwd(
+            paths,
+            wavelet,
+            max_level,
+            log_scale,
+            batch_size,
+            frechet_backend,
+            dtype,
+            packets_per_pass,
+            frechet_chunk,
+        )
+
+    reference = paths[0]
+    if not isinstance(reference, ReferenceStatistics):
+        # packed covariances halve the memory, the Frechet distances unpack
+        # them a chunk of packets at a time.
+        print(f"Computing stats for path: {reference}")
+        mu_1, sigma_1 = calculate_path_statistics(
+            reference, wavelet, max_level, log_scale, batch_size, dtype, packed=True
+        )
+        print(f"Computing stats for path: {generated}")
+        mu_2, sigma_2 = calculate_path_statistics(
+            generated, wavelet, max_level, log_scale, batch_size, dtype, packed=True
+        )
+        print("Computing Frechet distances for each packet.")
+        return _compute_avg_frechet_distance(
+            mu_1,
+            mu_2,
+            sigma_1,
+            sigma_2,
+            backend=frechet_backend,
+            packed=True,
+            chunk_size=frechet_chunk,
+        )
+
+    print(f"Computing stats for path: {generated}")
     mu_2, sigma_2 = calculate_path_statistics(
-        paths[1], wavelet, max_level, log_scale, batch_size
+        generated, wavelet, max_level, log_scale, batch_size, dtype
     )
-
     print("Computing Frechet distances for each packet.")
-    return _compute_avg_frechet_distance(mu_1, mu_2, sigma_1, sigma_2)
+    if frechet_backend == "scipy":
+        return _compute_avg_frechet_distance(
+            reference.mu, mu_2, reference.sigma, sigma_2, backend=frechet_backend
+        )
+    return reference.frechet_distance(
+        mu_2, sigma_2, backend=frechet_backend, chunk_size=frechet_chunk
+    )
+
+
+def _plan_passes(
+    paths: Sequence[Union[str, ReferenceStatistics]],
+    wavelet: str,
+    max_level: int,
+    batch_size: int,
+    frechet_backend: str,
+    dtype: th.dtype,
+    packets_per_pass: Optional[int],
+) -> Optional[MemoryPlan]:
+    """Plan the packets per pass and the Frechet chunk from the first image path.
+
+    Returns None without a memory budget or without an image path.
+    """
+    if MAX_MEMORY is None:
+        return None
+    for path in paths:
+        if isinstance(path, str) and not is_statistics_path(path):
+            dataset = _get_dataset(path)
+            if len(dataset) == 0:
+                continue
+            return plan_memory(
+                _get_image_shape(dataset),
+                wavelet,
+                max_level,
+                MAX_MEMORY,
+                batch_size,
+                dtype,
+                packets_per_pass=packets_per_pass,
+                frechet=frechet_backend == "torch",
+            )
+    return None
+
+
+def _compute_grouped_fwd(
+    paths: List[Union[str, ReferenceStatistics]],
+    wavelet: str,
+    max_level: int,
+    log_scale: bool,
+    batch_size: int,
+    frechet_backend: str,
+    dtype: th.dtype,
+    packets_per_pass: int,
+    frechet_chunk: int = FRECHET_CHUNK_SIZE,
+) -> float:
+    """Compute the FWD one group of packets at a time, see `compute_fwd`.
+
+    Image paths are decoded and transformed again for every group, so
+    `4**max_level / packets_per_pass` groups cost as many full passes over
+    the images. Saved statistics and ReferenceStatistics are only sliced.
+    The statistics cache is not used, its entries hold all packets.
+
+    Args:
+        paths (List[Union[str, ReferenceStatistics]]): Source and generated images.
+        wavelet (str): Choice of wavelet.
+        max_level (int): Decomposition level.
+        log_scale (bool): Apply log scale.
+        batch_size (int): Batch size for packet decomposition.
+        frechet_backend (str): Backend for the Frechet distances.
+        dtype (th.dtype): Precision of the packet transform.
+        packets_per_pass (int): Number of packets per group.
+        frechet_chunk (int): Packets whose Frechet distances are computed at
+            once. Defaults to `FRECHET_CHUNK_SIZE`.
+
+    Returns:
+        float: Frechet Wavelet Distance.
+    """
+    sources = [
+        (
+            path
+            if not isinstance(path, str)
+            else (
+                PacketStatistics.load(path)
+                if is_statistics_path(path)
+                else _get_dataset(path)
+            )
+        )
+        for path in paths
+    ]
+    packet_no = 4**max_level
+    print(f"Computing the FWD in groups of {packets_per_pass} packets.")
+    distances = []
+    for start in range(0, packet_no, packets_per_pass):
+        packets = slice(start, min(start + packets_per_pass, packet_no))
+        print(f"Computing packets {packets.start} to {packets.stop - 1} of {packet_no}")
+        (mu_1, sigma_1), (mu_2, sigma_2) = (
+            _get_group_statistics(
+                source, packets, wavelet, max_level, log_scale, batch_size, dtype
+            )
+            for source in sources
+        )
+        sqrt_sigma_1 = None
+        if isinstance(sources[0], ReferenceStatistics) and frechet_backend != "scipy":
+            # reuse the cached square roots of the reference.
+            sqrt_sigma_1 = sources[0].sqrt_sigma[packets]
+        distances.append(
+            calculate_frechet_distances(
+                mu_1,
+                sigma_1,
+                mu_2,
+                sigma_2,
+                backend=frechet_backend,
+                device=_get_device(),
+                sqrt_sigma1=sqrt_sigma_1,
+                chunk_size=frechet_chunk,
+            )
+        )
+    return np.mean(np.concatenate(distances))
+
+
+def _get_group_statistics(
+    source: Union[
+        ReferenceStatistics, PacketStatistics, ImagePathDataset, ShardedImageDataset
+    ],
+    packets: slice,
+    wavelet: str,
+    max_level: int,
+    log_scale: bool,
+    batch_size: int,
+    dtype: th.dtype,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Return mean and sigma of a range of packets of saved statistics or a dataset."""
+    if isinstance(source, ReferenceStatistics):
+        return source.mu[packets], source.sigma[packets]
+    if isinstance(source, PacketStatistics):
+        # statistics directories are memory mapped, only this group is read.
+        return source.get_mu(packets), source.get_sigma(packets)
+    return _compute_dataset_statistics(
+        source, wavelet, max_level, log_scale, batch_size, dtype, packets
+    ).compute()
+
+
+class FWDMetric:
+    """Frechet Wavelet Distance computed from in-memory image batches.
+
+    Batches of real and generated images are transformed and accumulated as
+    they arrive, no image ever has to be written to disk. Example::
+
+        metric = FWDMetric(wavelet="Haar", max_level=4)
+        metric.update(real_images, real=True)
+        metric.update(generator_samples, real=False)
+        fwd = metric.compute()
+    """
+
+    def __init__(
+        self,
+        wavelet: str = "sym5",
+        max_level: int = 4,
+        log_scale: bool = False,
+        reference: Optional[ReferenceStatistics] = None,
+        device: Optional[th.device] = None,
+        frechet_backend: str = "torch",
+        dtype: th.dtype = th.float64,
+    ):
+        """Create the metric.
+
+        Args:
+            wavelet (str): Choice of wavelet. Defaults to "sym5".
+            max_level (int): Decomposition level. Defaults to 4.
+            log_scale (bool): Apply log scale. Defaults to False.
+            reference (ReferenceStatistics, optional): Precomputed statistics
+                of the real images. If given, no real images can be added.
+                Defaults to None.
+            device (th.device, optional): Device for the packet transform and
+                the statistics. Defaults to the first GPU if available.
+            frechet_backend (str): Either "numpy" or "torch".
+                Defaults to "torch".
+            dtype (th.dtype): Precision of the packet transform.
+                Defaults to th.float64.
+        """
+        self.transform = WaveletPacketTransform(wavelet, max_level, log_scale)
+        self.reference = reference
+        if device is None:
+            device = _get_device()
+        self.device = device
+        self.frechet_backend = frechet_backend
+        self.dtype = dtype
+        self.reset()
+
+    def reset(self) -> None:
+        """Drop all accumulated images."""
+        self.real_statistics = RunningStatistics(device=self.device)
+        self.fake_statistics = RunningStatistics(device=self.device)
+
+    def update(self, images: Union[th.Tensor, Iterable[th.Tensor]], real: bool) -> None:
+        """Add images to the real or the generated statistics.
+
+        Args:
+            images (Union[th.Tensor, Iterable[th.Tensor]]): A batch of shape
+                [batch_size, channels, height, width] with values in [0, 1]
+                or uint8 values, or an iterable of such batches.
+            real (bool): True for real images, False for generated ones.
+
+        Raises:
+            ValueError: If real images are added to a metric with a reference.
+        """
+        if real and self.reference is not None:
+            raise ValueError("The real statistics are given by the reference.")
+        statistics = self.real_statistics if real else self.fake_statistics
+        batches = [images] if isinstance(images, th.Tensor) else images
+        with th.no_grad():
+            for img_batch in batches:
+                _update_packet_statistics(
+                    statistics, img_batch, self.transform, self.dtype
+                )
+
+    def compute(self) -> float:
+        """Compute the FWD between all real and generated images seen so far.
+
+        Returns:
+            float: Frechet Wavelet Distance.
+        """
+        if self.reference is None:
+            mu_1, sigma_1 = self.real_statistics.compute(packed=True)
+            mu_2, sigma_2 = self.fake_statistics.compute(packed=True)
+            return _compute_avg_frechet_distance(
+                mu_1, mu_2, sigma_1, sigma_2, self.frechet_backend, packed=True
+            )
+        mu_2, sigma_2 = self.fake_statistics.compute()
+        return self.reference.frechet_distance(
+            mu_2, sigma_2, backend=self.frechet_backend
+        )
 
 
 def _save_packets(
-    paths: List[str], wavelet: str, max_level: int, log_scale: bool, batch_size: int
+    paths: List[str],
+    wavelet: str,
+    max_level: int,
+    log_scale: bool,
+    batch_size: int,
+    dtype: th.dtype = th.float64,
+    packed: bool = False,
+    sigma_dtype: str = "float64",
 ) -> None:
     """Save packets.
 
     Args:
         paths (List[str]): List of paths containing input and output files.
+            Outputs ending in .npz are written as compressed npz file,
+            all others as statistics directory.
         wavelet (str): Choice of wavelet.
         max_level (int): Decomposition level.
         log_scale (bool): Apply log scale.
         batch_size (int): Batch size for packet decomposition.
+        dtype (th.dtype): Precision of the packet transform.
+            Defaults to th.float64.
+        packed (bool): Store only the upper triangles of sigma.
+            Defaults to False.
+        sigma_dtype (str): Storage precision of sigma. Defaults to "float64".
 
     Raises:
         RuntimeError: Error if input path is invalid.
         RuntimeError: Error if the output file already exists.
+        ValueError: If packing or reduced precision is requested for .npz.
     """
     if not os.path.exists(paths[0]):
         raise RuntimeError(f"Invalid path: {paths[0]}")
@@ -178,16 +926,182 @@ def _save_packets(
     if os.path.exists(paths[1]):
         raise RuntimeError(f"Stats file already exists at the given path: {paths[1]}")
 
+    # fail before the statistics pass instead of when saving its result.
+    if paths[1].endswith(".npz") and (packed or sigma_dtype != "float64"):
+        raise ValueError("Packed or reduced precision sigma needs a directory.")
+
     print(f"Computing stats for path: {paths[0]}")
-    mu_1, sigma_1 = calculate_path_statistics(
-        paths[0], wavelet, max_level, log_scale, batch_size
+    dataset = _get_dataset(paths[0])
+    statistics = _compute_dataset_statistics(
+        dataset, wavelet, max_level, log_scale, batch_size, dtype
+    )
+    _save_statistics(
+        paths[1],
+        statistics,
+        [os.path.basename(name) for name in dataset.files],
+        wavelet,
+        max_level,
+        log_scale,
+        packed,
+        sigma_dtype,
     )
-    np.savez_compressed(paths[1], mu=mu_1, sigma=sigma_1)
+
+
+def _save_statistics(
+    path: str,
+    statistics: RunningStatistics,
+    files: List[str],
+    wavelet: str,
+    max_level: int,
+    log_scale: bool,
+    packed: bool = False,
+    sigma_dtype: str = "float64",
+) -> None:
+    """Save packet statistics together with what is needed to extend them.
+
+    Next to mean and sigma the file stores the sample count, the names of
+    the included images and the transform parameters, see `_update_stats`.
+    In a distributed run only rank 0 writes the file.
+
+    Args:
+        path (str): Output npz file or statistics directory.
+        statistics (RunningStatistics): Accumulated packet statistics.
+        files (List[str]): Names of the images the statistics include.
+        wavelet (str): Choice of wavelet.
+        max_level (int): Decomposition level.
+        log_scale (bool): Apply log scale.
+        packed (bool): Store only the upper triangles of sigma.
+            Defaults to False.
+        sigma_dtype (str): Storage precision of sigma. Defaults to "float64".
+    """
+    if not _is_main_process():
+        return
+    mu, sigma = statistics.compute()
+    PacketStatistics(
+        mu,
+        sigma,
+        count=statistics.count,
+        files=files,
+        params={"wavelet": wavelet, "max_level": max_level, "log_scale": log_scale},
+    ).save(path, packed=packed, dtype=sigma_dtype)
+
+
+def _update_stats(
+    paths: List[str],
+    wavelet: str,
+    max_level: int,
+    log_scale: bool,
+    batch_size: int,
+    dtype: th.dtype = th.float64,
+) -> None:
+    """Add the images of a directory which are missing from saved statistics.
+
+    Only images whose names are not yet listed in the statistics file are
+    transformed. Their statistics are merged into the saved ones, the result
+    equals recomputing the statistics of the whole directory.
+
+    Args:
+        paths (List[str]): Image directory and a stats file written by `--save-packets`.
+        wavelet (str): Choice of wavelet.
+        max_level (int): Decomposition level.
+        log_scale (bool): Apply log scale.
+        batch_size (int): Batch size for packet decomposition.
+        dtype (th.dtype): Precision of the packet transform.
+            Defaults to th.float64.
+
+    Raises:
+        RuntimeError: Error if input path is invalid.
+        RuntimeError: Error if the stats file cannot be updated.
+    """
+    if not os.path.isdir(paths[0]) or is_image_cache(paths[0]):
+        raise RuntimeError(f"Invalid image directory: {paths[0]}")
+    if not os.path.exists(paths[1]):
+        raise RuntimeError(f"Stats file does not exist: {paths[1]}")
+
+    saved = PacketStatistics.load(paths[1])
+    if saved.count is None:
+        raise RuntimeError(
+            f"{paths[1]} has no sample count, recompute it with --save-packets."
+        )
+    params = (
+        saved.params["wavelet"],
+        saved.params["max_level"],
+        saved.params["log_scale"],
+    )
+    if params != (wavelet, max_level, log_scale):
+        raise RuntimeError(
+            f"{paths[1]} was computed with wavelet, max_level, log_scale = {params}."
+        )
+    statistics = RunningStatistics.from_statistics(
+        saved.count, saved.get_mu(), saved.get_sigma()
+    )
+    files = saved.files
+
+    included = set(files)
+    new_images = [
+        name for name in _get_image_names(paths[0]) if name.name not in included
+    ]
+    if not new_images:
+        print(f"No new images in {paths[0]}.")
+        return
+
+    print(f"Adding {len(new_images)} images to {paths[1]}")
+    dataset = ImagePathDataset(new_images, decoder=DECODER)
+    new_statistics = _compute_dataset_statistics(
+        dataset, wavelet, max_level, log_scale, batch_size, dtype
+    )
+    statistics.merge(new_statistics)
+    _save_statistics(
+        paths[1],
+        statistics,
+        files + [name.name for name in new_images],
+        wavelet,
+        max_level,
+        log_scale,
+        saved.packed,
+        str(saved.sigma.dtype),
+    )
+
+
+def _cache_images(paths: List[str], batch_size: int) -> None:
+    """Decode an image directory into a memory mapped image cache.
+
+    In a distributed run only the main process writes the cache,
+    the other ranks wait until it is complete.
+
+    Args:
+        paths (List[str]): Image directory and cache directory.
+        batch_size (int): Number of images decoded per batch.
+
+    Raises:
+        RuntimeError: Error if input path is invalid.
+        RuntimeError: Error if the cache already exists.
+    """
+    if not os.path.isdir(paths[0]):
+        raise RuntimeError(f"Invalid path: {paths[0]}")
+
+    if is_image_cache(paths[1]):
+        raise RuntimeError(f"Image cache already exists at the given path: {paths[1]}")
+
+    if _is_distributed():
+        # every rank checks the paths before the main process starts writing.
+        dist.barrier()
+    if _is_main_process():
+        print(f"Caching images of path: {paths[0]}")
+        cache_images(
+            [str(name) for name in _get_image_names(paths[0])],
+            paths[1],
+            batch_size,
+            num_workers=NUM_PROCESSES,
+            decoder=DECODER,
+        )
+    if _is_distributed():
+        dist.barrier()
 
 
 def main():
     """Compute FWD given paths."""
-    global NUM_PROCESSES, IMAGE_EXTS
+    global NUM_PROCESSES, IMAGE_EXTS, DECODER, STATS_CACHE, TIMING, MAX_MEMORY
 
     th.manual_seed(0)
     args = _parse_args()
@@ -201,18 +1115,97 @@ def main():
     else:
         NUM_PROCESSES = args.num_processes
     print(f"Num work: {NUM_PROCESSES}")
+    DECODER = args.decoder
+    if args.stats_cache is not None:
+        STATS_CACHE = StatisticsCache(args.stats_cache, args.stats_cache_size)
+    TIMING = args.timing
+    MAX_MEMORY = args.max_memory
     if args.deterministic:
         th.use_deterministic_algorithms(True)
+    if args.distributed:
+        # rank and world size are read from the environment set up by torchrun.
+        dist.init_process_group(backend="gloo")
+    try:
+        _run(args)
+    finally:
+        if args.distributed:
+            dist.destroy_process_group()
+
+
+def _run(args) -> None:
+    """Dispatch the parsed command line arguments."""
+    dtype = PRECISIONS[args.precision]
+    if args.cache_images:
+        _cache_images(args.path, args.batch_size)
+        return
+
+    if args.update_stats:
+        _update_stats(
+            args.path,
+            args.wavelet,
+            args.max_level,
+            args.log_scale,
+            args.batch_size,
+            dtype,
+        )
+        return
+
     if args.save_packets:
         _save_packets(
-            args.path, args.wavelet, args.max_level, args.log_scale, args.batch_size
+            args.path,
+            args.wavelet,
+            args.max_level,
+            args.log_scale,
+            args.batch_size,
+            dtype,
+            args.stats_packed,
+            args.stats_dtype,
+        )
+        return
+
+    if args.metric != "fwd":
+        # the WPKL builds on this module, import it only when needed.
+        from .wpkl import compute_fwd_wpkl, compute_wpkl
+
+        if args.metric == "wpkl":
+            wpkl = compute_wpkl(
+                args.path,
+                args.wavelet,
+                args.max_level,
+                args.log_scale,
+                args.batch_size,
+                dtype=dtype,
+            )
+            if _is_main_process():
+                print(f"WPKL: {wpkl}")
+            return
+        fwd, wpkl = compute_fwd_wpkl(
+            args.path,
+            args.wavelet,
+            args.max_level,
+            args.log_scale,
+            args.batch_size,
+            frechet_backend=args.frechet_backend,
+            dtype=dtype,
+            packets_per_pass=args.packets_per_pass,
         )
+        if _is_main_process():
+            print(f"FWD: {fwd}")
+            print(f"WPKL: {wpkl}")
         return
 
     fwd = compute_fwd(
-        args.path, args.wavelet, args.max_level, args.log_scale, args.batch_size
+        args.path,
+        args.wavelet,
+        args.max_level,
+        args.log_scale,
+        args.batch_size,
+        frechet_backend=args.frechet_backend,
+        dtype=dtype,
+        packets_per_pass=args.packets_per_pass,
     )
-    print(f"FWD: {fwd}")
+    if _is_main_process():
+        print(f"FWD: {fwd}")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,251 @@
+"""Memory estimates for the packet statistics computation."""
+
+import math
+from typing import Dict, NamedTuple, Optional, Tuple
+
+import pywt
+import torch
+
+from .freq_math import FRECHET_CHUNK_SIZE
+from .utils import _format_size
+
+
+class MemoryPlan(NamedTuple):
+    """Batch size and packet chunking that fit into a memory budget."""
+
+    batch_size: int
+    packet_chunk: int
+    packets_per_pass: int
+    frechet_chunk: int
+    estimate: Dict[str, int]
+
+
+def estimate_memory(
+    image_shape: Tuple[int, int, int],
+    wavelet: str,
+    max_level: int,
+    batch_size: int,
+    packet_chunk: int,
+    dtype: torch.dtype = torch.float64,
+    packets_per_pass: Optional[int] = None,
+    frechet_chunk: int = FRECHET_CHUNK_SIZE,
+) -> Dict[str, int]:
+    """Estimate the peak device memory of the packet statistics in bytes.
+
+    The estimate follows the buffers allocated per batch: the uint8 batch,
+    its prefetched successor and the float copy, the padded input and the
+    output of every transform level, the packet buffer, the float64
+    temporaries of updating `packet_chunk` packets at once and the
+    accumulated means and covariances of `packets_per_pass` packets.
+    The Frechet distances of a pass run after the statistics are complete
+    on chunks of `frechet_chunk` packets, their covariances, square roots
+    and products are estimated apart, as are the temporaries of the WPKL
+    histograms of a batch.
+
+    Args:
+        image_shape (Tuple[int, int, int]): Image shape [channels, height, width].
+        wavelet (str): Choice of wavelet.
+        max_level (int): Decomposition level.
+        batch_size (int): Images per batch.
+        packet_chunk (int): Packets whose cross-products are updated at once.
+        dtype (torch.dtype): Precision of the packet transform.
+            Defaults to torch.float64.
+        packets_per_pass (int, optional): Packets whose statistics are
+            accumulated in one pass over the images. Defaults to all packets.
+        frechet_chunk (int): Packets whose Frechet distances are computed at
+            once. Defaults to `FRECHET_CHUNK_SIZE`.
+
+    Returns:
+        Dict[str, int]: Bytes needed for the images, the transform,
+            the statistics update, the accumulated statistics, all of them
+            together in total, for the Frechet distances and for the
+            WPKL histograms.
+    """
+    channels, height, width = image_shape
+    filt_len = pywt.Wavelet(wavelet).dec_len
+    pad = (2 * filt_len - 3) // 2
+    item = torch.finfo(dtype).bits // 8
+    acc_item = torch.finfo(torch.float64).bits // 8
+
+    nodes = batch_size * channels
+    transform = 0
+    for _ in range(max_level):
+        padded = (height + 2 * pad + height % 2) * (width + 2 * pad + width % 2)
+        level_input = height * width
+        height = pywt.dwt_coeff_len(height, filt_len, "reflect")
+        width = pywt.dwt_coeff_len(width, filt_len, "reflect")
+        transform = max(
+            transform, nodes * (level_input + padded + 4 * height * width) * item
+        )
+        nodes *= 4
+    packets = 4**max_level
+    if packets_per_pass is not None:
+        packets = min(packets, packets_per_pass)
+    dim = channels * height * width
+    packet_buffer = batch_size * 4**max_level * dim * item
+    # the last level and the packet buffer are alive while packets are reordered.
+    transform = max(transform, 2 * packet_buffer)
+
+    estimate = {
+        "images": batch_size * math.prod(image_shape) * (2 + item),
+        "transform": transform,
+        "update": packet_buffer
+        + min(packet_chunk, packets) * (batch_size * dim + dim * dim) * acc_item,
+        "statistics": packets * dim * (dim + 1) * acc_item,
+    }
+    estimate["total"] = (
+        estimate["images"]
+        + estimate["statistics"]
+        + max(estimate["transform"], estimate["update"])
+    )
+    # both covariance stacks, the square roots, a product and the eigensolver
+    # for one chunk of packets.
+    estimate["frechet"] = 5 * min(packets, frechet_chunk) * dim * dim * acc_item
+    # the packet buffer, its normalized copy and two int64 bin indices
+    # per coefficient.
+    estimate["histograms"] = packet_buffer * 2 + batch_size * 4**max_level * dim * 16
+    return estimate
+
+
+def plan_memory(
+    image_shape: Tuple[int, int, int],
+    wavelet: str,
+    max_level: int,
+    max_memory: int,
+    max_batch_size: int,
+    dtype: torch.dtype = torch.float64,
+    packets_per_pass: Optional[int] = None,
+    frechet: bool = False,
+) -> MemoryPlan:
+    """Choose packets per pass, batch size and packet and Frechet chunks within a budget.
+
+    Passes over the images are the most expensive, so the plan first takes
+    the most packets per pass, then the largest batch size and finally the
+    largest packet chunk that fit into the budget. The Frechet distances run
+    after the statistics of a pass are complete, their chunk is planned
+    apart and never reduces the packets per pass.
+
+    Args:
+        image_shape (Tuple[int, int, int]): Image shape [channels, height, width].
+        wavelet (str): Choice of wavelet.
+        max_level (int): Decomposition level.
+        max_memory (int): Memory budget in bytes.
+        max_batch_size (int): Largest batch size to consider.
+        dtype (torch.dtype): Precision of the packet transform.
+            Defaults to torch.float64.
+        packets_per_pass (int, optional): Fixed number of packets per pass.
+            Defaults to None, which chooses it.
+        frechet (bool): Also fit the Frechet distances into the budget.
+            Defaults to False.
+
+    Raises:
+        ValueError: If a single image with single packet updates, or the
+            Frechet distance of a single packet, exceeds the budget.
+
+    Returns:
+        MemoryPlan: Batch size, packet chunk, packets per pass, Frechet chunk
+            and their estimate.
+    """
+
+    def estimate(
+        batch_size: int, packet_chunk: int, group: int, frechet_chunk: int = 1
+    ) -> Dict[str, int]:
+        return estimate_memory(
+            image_shape,
+            wavelet,
+            max_level,
+            batch_size,
+            packet_chunk,
+            dtype,
+            group,
+            frechet_chunk,
+        )
+
+    def fits(batch_size: int, packet_chunk: int, group: int) -> bool:
+        return estimate(batch_size, packet_chunk, group)["total"] <= max_memory
+
+    group = packets_per_pass if packets_per_pass is not None else 1
+    minimum = estimate(1, 1, group)
+    if minimum["total"] > max_memory:
+        raise ValueError(
+            f"The packet statistics need at least {_format_size(minimum['total'])}, "
+            f"{_format_size(minimum['statistics'])} of them for the accumulated "
+            f"covariances of {min(group, 4**max_level)} packets, "
+            f"but the memory budget is {_format_size(max_memory)}."
+        )
+    if frechet and minimum["frechet"] > max_memory:
+        raise ValueError(
+            f"The Frechet distance of a single packet needs "
+            f"{_format_size(minimum['frechet'])}, "
+            f"but the memory budget is {_format_size(max_memory)}."
+        )
+    if packets_per_pass is None:
+        group = _largest(lambda size: fits(1, 1, size), 4**max_level)
+    batch_size = _largest(lambda size: fits(size, 1, group), max_batch_size)
+    packet_chunk = _largest(lambda chunk: fits(batch_size, chunk, group), group)
+    frechet_chunk = FRECHET_CHUNK_SIZE
+    if frechet:
+        frechet_chunk = _largest(
+            lambda chunk: estimate(1, 1, group, chunk)["frechet"] <= max_memory,
+            FRECHET_CHUNK_SIZE,
+        )
+    return MemoryPlan(
+        batch_size,
+        packet_chunk,
+        group,
+        frechet_chunk,
+        estimate(batch_size, packet_chunk, group, frechet_chunk),
+    )
+
+
+def plan_histogram_batch_size(
+    image_shape: Tuple[int, int, int],
+    wavelet: str,
+    max_level: int,
+    max_memory: int,
+    max_batch_size: int,
+    dtype: torch.dtype = torch.float64,
+) -> int:
+    """Choose the largest batch size of the WPKL passes within a budget.
+
+    The maxima and histogram passes hold no statistics, a batch needs its
+    images and the larger of the transform and the histogram temporaries.
+
+    Args:
+        image_shape (Tuple[int, int, int]): Image shape [channels, height, width].
+        wavelet (str): Choice of wavelet.
+        max_level (int): Decomposition level.
+        max_memory (int): Memory budget in bytes.
+        max_batch_size (int): Largest batch size to consider.
+        dtype (torch.dtype): Precision of the packet transform.
+            Defaults to torch.float64.
+
+    Raises:
+        ValueError: If the histograms of a single image exceed the budget.
+
+    Returns:
+        int: The batch size.
+    """
+
+    def needed(batch_size: int) -> int:
+        estimate = estimate_memory(image_shape, wavelet, max_level, batch_size, 1, dtype)
+        return estimate["images"] + max(estimate["transform"], estimate["histograms"])
+
+    if needed(1) > max_memory:
+        raise ValueError(
+            f"The WPKL histograms of a single image need {_format_size(needed(1))}, "
+            f"but the memory budget is {_format_size(max_memory)}."
+        )
+    return _largest(lambda size: needed(size) <= max_memory, max_batch_size)
+
+
+def _largest(fits, upper: int) -> int:
+    """Binary search the largest value in [1, upper] that fits, fits(1) must hold."""
+    lower = 1
+    while lower < upper:
+        middle = (lower + upper + 1) // 2
+        if fits(middle):
+            lower = middle
+        else:
+            upper = middle - 1
+    return lower
@@ -0,0 +1,226 @@
+"""Saved packet statistics with memory mapped, packet level access."""
+
+import json
+import os
+import shutil
+from typing import Any, Dict, List, Optional, Union
+
+import numpy as np
+
+from .freq_math import pack_symmetric, unpack_symmetric
+
+STATS_META = "meta.json"
+STATS_DTYPES = {"float64": np.float64, "float32": np.float32, "float16": np.float16}
+
+
+def is_statistics_dir(path: str) -> bool:
+    """Check if a path points to a statistics directory written by `PacketStatistics`.
+
+    Args:
+        path (str): Path to check.
+
+    Returns:
+        bool: True if the path is a statistics directory.
+    """
+    return os.path.isfile(os.path.join(path, STATS_META))
+
+
+def is_statistics_path(path: str) -> bool:
+    """Check if a path holds saved statistics instead of images.
+
+    Args:
+        path (str): Path to check.
+
+    Returns:
+        bool: True for .npz and .npy files and statistics directories.
+    """
+    return path.endswith((".npz", ".npy")) or is_statistics_dir(path)
+
+
+class PacketStatistics:
+    """Packet means and covariances as loaded from or saved to disk.
+
+    Two formats are supported. ``.npz`` files hold dense float64 arrays and
+    are read completely. Statistics directories hold ``mu.npy``,
+    ``sigma.npy`` and ``files.npy`` next to ``meta.json``; the arrays are
+    memory mapped, so single packets are read without loading the rest.
+    In a directory sigma may be stored in reduced precision and as upper
+    triangles only. The accessors always return dense float64 arrays.
+    """
+
+    def __init__(
+        self,
+        mu: np.ndarray,
+        sigma: np.ndarray,
+        count: Optional[int] = None,
+        files: Optional[List[str]] = None,
+        params: Optional[Dict[str, Union[str, int, bool]]] = None,
+        packed: bool = False,
+    ):
+        """Wrap packet statistics.
+
+        Args:
+            mu (np.ndarray): Means of shape [packets, dim].
+            sigma (np.ndarray): Covariances of shape [packets, dim, dim],
+                or their upper triangles if `packed`.
+            count (int, optional): Number of images. Defaults to None.
+            files (List[str], optional): Names of the included images.
+                Defaults to None.
+            params (dict, optional): Wavelet, max_level and log_scale of the
+                transform. Defaults to None.
+            packed (bool): Sigma holds upper triangles only. Defaults to False.
+        """
+        self.mu = mu
+        self.sigma = sigma
+        self.count = count
+        self.files = files
+        self.params = params if params is not None else {}
+        self.packed = packed
+
+    def __len__(self) -> int:
+        """Return the number of packets."""
+        return len(self.mu)
+
+    def get_mu(self, packets: Optional[Union[slice, int]] = None) -> np.ndarray:
+        """Read packet means.
+
+        Args:
+            packets (Union[slice, int], optional): Packets to read.
+                Defaults to None, which reads all packets.
+
+        Returns:
+            np.ndarray: Writable float64 copy of the packet means.
+        """
+        packets = packets if packets is not None else slice(None)
+        # copy, the memory map of a directory is read-only.
+        return np.array(self.mu[packets], dtype=np.float64)
+
+    def get_sigma(
+        self, packets: Optional[Union[slice, int]] = None, packed: bool = False
+    ) -> np.ndarray:
+        """Read packet covariances.
+
+        Args:
+            packets (Union[slice, int], optional): Packets to read.
+                Defaults to None, which reads all packets.
+            packed (bool): Return upper triangles instead of dense matrices.
+                Defaults to False.
+
+        Returns:
+            np.ndarray: Writable float64 copy of the packet covariances.
+        """
+        packets = packets if packets is not None else slice(None)
+        sigma = np.array(self.sigma[packets], dtype=np.float64)
+        if packed != self.packed:
+            return pack_symmetric(sigma) if packed else unpack_symmetric(sigma)
+        return sigma
+
+    @classmethod
+    def load(cls, path: str) -> "PacketStatistics":
+        """Open saved statistics.
+
+        Args:
+            path (str): .npz file or statistics directory.
+
+        Returns:
+            PacketStatistics: The statistics, memory mapped for directories.
+        """
+        if is_statistics_dir(path):
+            with open(os.path.join(path, STATS_META)) as fp:
+                meta = json.load(fp)
+            files_path = os.path.join(path, "files.npy")
+            return cls(
+                np.load(os.path.join(path, "mu.npy"), mmap_mode="r"),
+                np.load(os.path.join(path, "sigma.npy"), mmap_mode="r"),
+                count=meta.get("count"),
+                files=(
+                    [str(name) for name in np.load(files_path)]
+                    if os.path.exists(files_path)
+                    else None
+                ),
+                params=meta.get("params"),
+                packed=meta["packed"],
+            )
+        with np.load(path) as fp:
+            if "count" not in fp:
+                return cls(fp["mu"][:], fp["sigma"][:])
+            return cls(
+                fp["mu"][:],
+                fp["sigma"][:],
+                count=int(fp["count"]),
+                files=[str(name) for name in fp["files"]],
+                params={
+                    "wavelet": str(fp["wavelet"]),
+                    "max_level": int(fp["max_level"]),
+                    "log_scale": bool(fp["log_scale"]),
+                },
+            )
+
+    def save(self, path: str, packed: bool = False, dtype: str = "float64") -> None:
+        """Save the statistics, replacing existing statistics at once.
+
+        Args:
+            path (str): Output path. Paths ending in .npz are written as a
+                compressed dense float64 file, all others as a directory.
+            packed (bool): Store only the upper triangles of sigma.
+                Defaults to False.
+            dtype (str): Storage precision of sigma, one of "float64",
+                "float32" or "float16". Defaults to "float64".
+
+        Raises:
+            ValueError: If packing or reduced precision is requested for .npz.
+        """
+        if path.endswith(".npz"):
+            if packed or dtype != "float64":
+                raise ValueError("Packed or reduced precision sigma needs a directory.")
+            # write to a temporary file first, so an interrupted update keeps the old stats.
+            tmp_path = f"{path[:-4]}.tmp.npz"
+            extra: Dict[str, Any] = {}
+            if self.count is not None:
+                extra = dict(
+                    count=self.count,
+                    files=np.array(sorted(self.files or []), dtype=str),
+                    **self.params,
+                )
+            np.savez_compressed(
+                tmp_path, mu=self.get_mu(), sigma=self.get_sigma(), **extra
+            )
+            os.replace(tmp_path, path)
+            return
+
+        path = path.rstrip(os.sep)
+        tmp_path = f"{path}.tmp"
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        os.makedirs(tmp_path)
+        np.save(os.path.join(tmp_path, "mu.npy"), self.get_mu())
+        dim = self.mu.shape[-1]
+        sigma = np.lib.format.open_memmap(
+            os.path.join(tmp_path, "sigma.npy"),
+            mode="w+",
+            dtype=STATS_DTYPES[dtype],
+            shape=(len(self),) + ((dim * (dim + 1) // 2,) if packed else (dim, dim)),
+        )
+        # one packet at a time, the dense stack is never held in memory.
+        for packet in range(len(self)):
+            sigma[packet] = self.get_sigma(packet, packed=packed)
+        sigma.flush()
+        del sigma
+        if self.files is not None:
+            np.save(
+                os.path.join(tmp_path, "files.npy"),
+                np.array(sorted(self.files), dtype=str),
+            )
+        meta = {
+            "count": self.count,
+            "params": self.params,
+            "packed": packed,
+            "dtype": dtype,
+        }
+        with open(os.path.join(tmp_path, STATS_META), "w") as fp:
+            json.dump(meta, fp)
+
+        old_path = f"{path}.old"
+        if os.path.exists(path):
+            os.replace(path, old_path)
+        os.replace(tmp_path, path)
+        shutil.rmtree(old_path, ignore_errors=True)
@@ -1,10 +1,35 @@
 """Utilities file."""
 
+import time
 from argparse import ArgumentDefaultsHelpFormatter, ArgumentParser
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
 
+import numpy as np
 import torch as th
+import torchvision.io as tio
 from PIL import Image
 
+from .freq_math import FRECHET_BACKENDS
+
+
+def _parse_size(size: str) -> int:
+    """Parse a size like 512MB or 8GB into bytes."""
+    units = {"KB": 2**10, "MB": 2**20, "GB": 2**30, "TB": 2**40, "B": 1}
+    size = size.strip().upper()
+    for unit, factor in units.items():
+        if size.endswith(unit):
+            return int(float(size[: -len(unit)]) * factor)
+    return int(size)
+
+
+def _format_size(size: int) -> str:
+    """Format a number of bytes like 1.5GB."""
+    for unit, factor in (("TB", 2**40), ("GB", 2**30), ("MB", 2**20), ("KB", 2**10)):
+        if size >= factor:
+            return f"{size / factor:.1f}{unit}"
+    return f"{size}B"
+
 
 def _parse_args():
     """Argument parser."""
@@ -19,7 +44,86 @@ def _parse_args():
         "--num-processes", type=int, default=None, help="Number of multiprocess."
     )
     parser.add_argument(
-        "--save-packets", action="store_true", help="Save the packets as npz file."
+        "--decoder",
+        type=str,
+        default="pil",
+        choices=["pil", "torchvision"],
+        help="Image decoder backend.",
+    )
+    parser.add_argument(
+        "--save-packets",
+        action="store_true",
+        help="Save the packet statistics of the first path to the second path, "
+        "as npz file for a .npz suffix and as statistics directory otherwise.",
+    )
+    parser.add_argument(
+        "--stats-dtype",
+        type=str,
+        default="float64",
+        choices=["float64", "float32", "float16"],
+        help="Storage precision of the covariances saved with --save-packets "
+        "to a statistics directory, i.e. an output path without .npz suffix.",
+    )
+    parser.add_argument(
+        "--stats-packed",
+        action="store_true",
+        help="Store only the upper triangles of the covariances saved with "
+        "--save-packets to a statistics directory.",
+    )
+    parser.add_argument(
+        "--update-stats",
+        action="store_true",
+        help="Add images of the first path which are missing from the "
+        "stats file at the second path to its statistics.",
+    )
+    parser.add_argument(
+        "--cache-images",
+        action="store_true",
+        help="Decode the images of the first path into a memory mapped cache "
+        "at the second path. The cache can be used in place of the image path.",
+    )
+    parser.add_argument(
+        "--stats-cache",
+        type=str,
+        default=None,
+        help="Directory for automatically cached statistics of image paths.",
+    )
+    parser.add_argument(
+        "--stats-cache-size",
+        type=_parse_size,
+        default="10GB",
+        help="Maximum size of the statistics cache, e.g. 500MB or 10GB.",
+    )
+    parser.add_argument(
+        "--max-memory",
+        type=_parse_size,
+        default=None,
+        help="Device memory budget, e.g. 8GB. Chooses the batch size, at most "
+        "--batch-size, and the packets updated at once to fit into the budget. "
+        "Applies to every --metric, the WPKL passes only reduce the batch size.",
+    )
+    parser.add_argument(
+        "--packets-per-pass",
+        type=int,
+        default=None,
+        help="Compute the FWD for groups of this many packets, one pass over "
+        "the images per group. Bounds memory by the group size, chosen from "
+        "--max-memory if not given. With --metric both the first group also "
+        "finds the WPKL packet maxima, --metric wpkl ignores it.",
+    )
+    parser.add_argument(
+        "--distributed",
+        action="store_true",
+        help="Shard the images across the processes started by torchrun and "
+        "all-reduce the statistics, uses the gloo backend.",
+    )
+    parser.add_argument(
+        "--metric",
+        type=str,
+        default="fwd",
+        choices=["fwd", "wpkl", "both"],
+        help="Compute the FWD, the KL wavelet packet divergence or both. "
+        "'both' shares the packet transform of the first pass over the images.",
     )
     parser.add_argument(
         "--wavelet", type=str, default="sym5", help="Choice of wavelet."
@@ -30,6 +134,29 @@ def _parse_args():
     parser.add_argument(
         "--log_scale", action="store_true", help="Use log scaling for wavelets."
     )
+    parser.add_argument(
+        "--frechet-backend",
+        type=str,
+        default="scipy",
+        choices=FRECHET_BACKENDS,
+        help="Backend for the per-packet Frechet distances. 'scipy' computes "
+        "the reference sqrtm per packet, 'numpy' and 'torch' batch all packets "
+        "with symmetric eigendecompositions.",
+    )
+    parser.add_argument(
+        "--precision",
+        type=str,
+        default="float64",
+        choices=["float32", "float64"],
+        help="Precision of the wavelet packet transform. "
+        "Statistics are always accumulated in float64.",
+    )
+    parser.add_argument(
+        "--timing",
+        action="store_true",
+        help="Print the time spent loading, transforming and accumulating batches. "
+        "Synchronizes the device after every stage.",
+    )
     parser.add_argument(
         "--deterministic",
         action="store_true",
@@ -39,18 +166,192 @@ def _parse_args():
         "path",
         type=str,
         nargs=2,
-        help="Path to the generated images or path to .npz statistics file.",
+        help="Path to the generated images, to an image cache, "
+        "to a .npz statistics file or to a statistics directory.",
     )
     return parser.parse_args()
 
 
+def _to_float_batch(
+    img_batch: th.Tensor, device: th.device, dtype: th.dtype
+) -> th.Tensor:
+    """Move an image batch to the device and convert it to floats in [0, 1].
+
+    uint8 batches are scaled by 1/255, floating point batches are only cast.
+
+    Args:
+        img_batch (th.Tensor): Image batch of shape [batch_size, channels, height, width].
+        device (th.device): Target device.
+        dtype (th.dtype): Target floating point type.
+
+    Returns:
+        th.Tensor: The converted batch on `device`.
+    """
+    # copy before casting, uint8 batches move a quarter of the float32 bytes.
+    # only host to gpu copies may be asynchronous, the cpu would read a gpu to
+    # host copy before it has finished.
+    img_batch = img_batch.to(
+        device=device, non_blocking=th.device(device).type == "cuda"
+    )
+    if img_batch.dtype == th.uint8:
+        return img_batch.to(dtype=dtype) / 255.0
+    return img_batch.to(dtype=dtype)
+
+
+class StageTimer:
+    """Wall clock time spent in the stages of the statistics pipeline.
+
+    The device is synchronized at every stage boundary, so asynchronous
+    kernels are attributed to the stage that launched them. A disabled
+    timer neither synchronizes nor measures anything.
+    """
+
+    def __init__(self, enabled: bool = True, device: Optional[th.device] = None):
+        """Create a timer.
+
+        Args:
+            enabled (bool): Measure the stages. Defaults to True.
+            device (th.device, optional): Device to synchronize. Defaults to None.
+        """
+        self.enabled = enabled
+        self.device = device
+        self.times: Dict[str, float] = {}
+        self._start: Optional[float] = None
+
+    def _synchronize(self) -> None:
+        if self.device is not None and self.device.type == "cuda":
+            th.cuda.synchronize(self.device)
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        """Add the time spent in the with block to a stage.
+
+        Args:
+            name (str): Name of the stage.
+
+        Yields:
+            None: Nothing, the block is timed.
+        """
+        if not self.enabled:
+            yield
+            return
+        self._synchronize()
+        start = time.perf_counter()
+        if self._start is None:
+            self._start = start
+        try:
+            yield
+        finally:
+            self._synchronize()
+            self.times[name] = self.times.get(name, 0.0) + time.perf_counter() - start
+
+    def iterate(self, name: str, iterable: Iterable) -> Iterator:
+        """Iterate and add the time spent waiting for every item to a stage.
+
+        Args:
+            name (str): Name of the stage.
+            iterable (Iterable): Items to time.
+
+        Yields:
+            Iterator: The items of the iterable.
+        """
+        iterator = iter(iterable)
+        while True:
+            with self.stage(name):
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+            yield item
+
+    def summary(self) -> str:
+        """Format the stage times and the total wall clock time.
+
+        Returns:
+            str: One line with the seconds spent per stage.
+        """
+        total = time.perf_counter() - self._start if self._start is not None else 0.0
+        stages = [f"{name} {seconds:.2f}s" for name, seconds in self.times.items()]
+        return ", ".join(stages + [f"total {total:.2f}s"])
+
+
+def _open_pil(path) -> Image.Image:
+    """Decode an image with PIL into an RGB image."""
+    with Image.open(path) as img:
+        return img.convert("RGB")
+
+
+def _read_pil(path) -> th.Tensor:
+    """Decode an image with PIL into a uint8 [3, height, width] tensor."""
+    return th.from_numpy(np.array(_open_pil(path))).permute(2, 0, 1)
+
+
+def _read_bytes(path) -> th.Tensor:
+    """Read the raw encoded bytes of an image file."""
+    return tio.read_file(str(path))
+
+
+def _decode_bytes(encoded: List[th.Tensor]) -> List[th.Tensor]:
+    """Decode a batch of encoded images into uint8 [3, height, width] tensors.
+
+    JPEGs of a batch are decoded by a single batched `decode_jpeg` call,
+    all other formats by `decode_image`.
+
+    Args:
+        encoded (List[th.Tensor]): Raw file contents as uint8 tensors.
+
+    Returns:
+        List[th.Tensor]: The decoded images in input order.
+    """
+    is_jpeg = [bool(data[0] == 0xFF and data[1] == 0xD8) for data in encoded]
+    jpegs = [data for data, jpeg in zip(encoded, is_jpeg) if jpeg]
+    decoded_jpegs = iter(
+        tio.decode_jpeg(jpegs, mode=tio.ImageReadMode.RGB) if jpegs else []
+    )
+    return [
+        (
+            next(decoded_jpegs)
+            if jpeg
+            else tio.decode_image(data, mode=tio.ImageReadMode.RGB)
+        )
+        for data, jpeg in zip(encoded, is_jpeg)
+    ]
+
+
+# Each decoder maps a name to a per-file read function and an optional batch
+# decode function. Without a batch decoder the read function has to return
+# the decoded uint8 image, otherwise decoding happens batch-wise on collate.
+DECODERS: Dict[
+    str,
+    Tuple[
+        Callable[..., th.Tensor],
+        Optional[Callable[[List[th.Tensor]], List[th.Tensor]]],
+    ],
+] = {
+    "pil": (_read_pil, None),
+    "torchvision": (_read_bytes, _decode_bytes),
+}
+
+
 class ImagePathDataset(th.utils.data.Dataset):
-    """Image dataset."""
+    """Image dataset.
+
+    Images are returned as uint8 tensors of shape [3, height, width],
+    conversion to floating point is left to the consumer of a batch.
+    Pass `collate` as `collate_fn` to the DataLoader, it runs the batched
+    decoders inside the loader workers.
 
-    def __init__(self, files, transforms=None):
+    With the "pil" decoder `transforms` receive the PIL image, so PIL
+    transforms like ``ToTensor()`` keep working. With the "torchvision"
+    decoder they receive the decoded uint8 tensors.
+    """
+
+    def __init__(self, files, transforms=None, decoder="pil"):
         """File initialization."""
         self.files = files
         self.transforms = transforms
+        self.decoder = decoder
+        self.read_fn, self.decode_fn = DECODERS[decoder]
 
     def __len__(self):
         """Length of dataset."""
@@ -58,8 +359,15 @@ class ImagePathDataset(th.utils.data.Dataset):
 
     def __getitem__(self, i):
         """Load the image."""
-        path = self.files[i]
-        img = Image.open(path).convert("RGB")
+        if self.decoder == "pil" and self.transforms is not None:
+            return self.transforms(_open_pil(self.files[i]))
+        return self.read_fn(self.files[i])
+
+    def collate(self, batch: List[th.Tensor]) -> th.Tensor:
+        """Decode and stack a list of dataset items."""
+        if self.decode_fn is None:
+            return th.utils.data.default_collate(batch)
+        images = self.decode_fn(batch)
         if self.transforms is not None:
-            img = self.transforms(img)
-        return img
+            images = [self.transforms(img) for img in images]
+        return th.utils.data.default_collate(images)
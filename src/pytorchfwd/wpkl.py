@@ -0,0 +1,494 @@
+"""Kullback-Leibler Wavelet Packet Divergence (WPKL).
+
+The WPKL compares histograms of the wavelet packet coefficients of two image
+sets. Every packet and channel is normalized by the largest absolute
+coefficient found in either set, binned over [-1, 1] and the symmetric KL
+divergence of the two histograms is averaged over all packets.
+"""
+
+import os
+from typing import List, Optional, Tuple, Union
+
+import numpy as np
+import torch as th
+import torch.distributed as dist
+from tqdm import tqdm
+
+from .cache import ShardedImageDataset
+from .freq_math import (
+    FRECHET_CHUNK_SIZE,
+    WaveletPacketTransform,
+    calculate_frechet_distances,
+    compute_kl_divergence,
+)
+from .fwd import (
+    _compute_dataset_statistics,
+    _get_dataloader,
+    _get_dataset,
+    _get_device,
+    _get_image_shape,
+    _is_distributed,
+    _plan_histogram_batch_size,
+    _plan_passes,
+    _prefetch,
+)
+from .statistics import is_statistics_path
+from .utils import ImagePathDataset, _to_float_batch
+
+
+def packet_max_abs(packets: th.Tensor) -> th.Tensor:
+    """Compute the largest absolute coefficient of every packet and channel.
+
+    Args:
+        packets (th.Tensor): Packets of shape [batch_size, packets, channels, height, width].
+
+    Returns:
+        th.Tensor: Maxima of shape [packets, channels].
+    """
+    return th.amax(th.abs(packets), dim=(0, 3, 4))
+
+
+def packet_histograms(packets: th.Tensor, max_val: th.Tensor, bins: int) -> th.Tensor:
+    """Count the coefficients of all packets and channels in one pass.
+
+    Every packet and channel is divided by its maximum and binned into `bins`
+    equal bins over [-1, 1]. Like `th.histogram` the coefficients are compared
+    against the bin edges, so values on an edge, which are frequent for
+    quantized images, fall into the upper bin and 1 into the last bin. Bin
+    indices are offset by packet and channel, so a single `scatter_add_`
+    fills all histograms.
+
+    Args:
+        packets (th.Tensor): Packets of shape [batch_size, packets, channels, height, width].
+        max_val (th.Tensor): Normalization of shape [packets, channels].
+        bins (int): Number of bins.
+
+    Returns:
+        th.Tensor: int64 counts of shape [packets, channels, bins].
+    """
+    _, num_packets, channels, _, _ = packets.shape
+    scaled = packets / max_val[None, :, :, None, None]
+    edges = th.linspace(-1, 1, bins + 1, dtype=scaled.dtype, device=scaled.device)
+    index = (th.bucketize(scaled, edges, right=True) - 1).clamp_(0, bins - 1)
+    offsets = th.arange(num_packets * channels, device=packets.device) * bins
+    index += offsets.reshape(1, num_packets, channels, 1, 1)
+    index = index.flatten()
+    counts = th.zeros(
+        num_packets * channels * bins, dtype=th.int64, device=index.device
+    )
+    counts.scatter_add_(
+        0, index, th.ones(1, dtype=th.int64, device=index.device).expand_as(index)
+    )
+    return counts.reshape(num_packets, channels, bins)
+
+
+def _histogram_density(counts: th.Tensor) -> th.Tensor:
+    """Normalize histogram counts over [-1, 1] to densities.
+
+    Args:
+        counts (th.Tensor): Counts of shape [..., bins].
+
+    Returns:
+        th.Tensor: float64 densities like `th.histogram(..., density=True)`.
+    """
+    bin_width = 2 / counts.shape[-1]
+    counts = counts.to(th.float64)
+    return counts / (th.sum(counts, dim=-1, keepdim=True) * bin_width)
+
+
+def _rice_bins(samples: int) -> int:
+    """Use rice rule for number of bins.
+
+    Args:
+        samples (int): Number of coefficients per packet and channel.
+
+    Returns:
+        int: Number of bins.
+    """
+    return int(2 * samples ** (1 / 3))
+
+
+def _joint_max(max_0: th.Tensor, max_1: th.Tensor) -> th.Tensor:
+    """Combine the maxima of both datasets, empty packets keep a tiny scale.
+
+    Args:
+        max_0 (th.Tensor): Maxima of the original packets.
+        max_1 (th.Tensor): Maxima of the target packets.
+
+    Returns:
+        th.Tensor: Normalization of shape [packets, channels].
+    """
+    max_val = th.maximum(max_0, max_1)
+    return th.where(max_val == 0, th.full_like(max_val, 1e-12), max_val)
+
+
+def histogram_divergence(counts_0: th.Tensor, counts_1: th.Tensor) -> float:
+    """Compute the symmetric KL divergence of packet histograms.
+
+    Args:
+        counts_0 (th.Tensor): Counts of the original packets
+            of shape [packets, channels, bins].
+        counts_1 (th.Tensor): Counts of the target packets.
+
+    Returns:
+        float: Wavelet power divergence.
+    """
+    p0_hist = _histogram_density(counts_0)
+    p1_hist = _histogram_density(counts_1)
+    kld_ab = compute_kl_divergence(p0_hist, p1_hist)
+    kld_ba = compute_kl_divergence(p1_hist, p0_hist)
+    # every packet has channels * bins entries, the mean equals the avg over packets.
+    return float(th.mean(0.5 * (kld_ab + kld_ba)).item())
+
+
+def wavelet_power_divergence(packets_0: th.Tensor, packets_1: th.Tensor) -> float:
+    """Compute Wavelet Power Divergence of packets held in memory.
+
+    Args:
+        packets_0 (th.Tensor): Original packets.
+        packets_1 (th.Tensor): Target packets.
+
+    Returns:
+        float: Wavelet power divergence.
+    """
+    assert packets_0.shape == packets_1.shape, "Packets are of not same shape"
+    Bs, _, _, H, W = packets_0.shape
+    bins = _rice_bins(Bs * H * W)
+    max_val = _joint_max(packet_max_abs(packets_0), packet_max_abs(packets_1))
+    return histogram_divergence(
+        packet_histograms(packets_0, max_val, bins),
+        packet_histograms(packets_1, max_val, bins),
+    )
+
+
+class PacketMaxima:
+    """Running maximum of the absolute coefficients of every packet and channel.
+
+    Fed batch by batch through `update`, the first of the two WPKL passes.
+    """
+
+    def __init__(self, shape: Tuple[int, int], device: Optional[th.device] = None):
+        """Create an empty accumulator.
+
+        Args:
+            shape (Tuple[int, int]): Number of packets and channels.
+            device (th.device, optional): Device of the maxima. Defaults to None.
+        """
+        self.max_val = th.zeros(shape, dtype=th.float64, device=device)
+        self.samples = 0
+
+    def update(self, packets: th.Tensor) -> None:
+        """Add a packet batch.
+
+        Args:
+            packets (th.Tensor): Packets of shape [batch_size, packets, channels, height, width].
+        """
+        self.max_val = th.maximum(self.max_val, packet_max_abs(packets).to(th.float64))
+        self.samples += packets.shape[0] * packets.shape[-2] * packets.shape[-1]
+
+    def all_reduce(self, group: Optional[dist.ProcessGroup] = None) -> None:
+        """Combine the maxima of all ranks, runs on the cpu for the gloo backend.
+
+        Args:
+            group (dist.ProcessGroup, optional): Process group to reduce over.
+                Defaults to the default group.
+        """
+        max_val = self.max_val.cpu()
+        dist.all_reduce(max_val, op=dist.ReduceOp.MAX, group=group)
+        samples = th.tensor(self.samples, dtype=th.int64)
+        dist.all_reduce(samples, group=group)
+        self.max_val = max_val.to(self.max_val.device)
+        self.samples = int(samples)
+
+
+class PacketHistograms:
+    """Histogram counts of every packet and channel for fixed maxima.
+
+    Fed batch by batch through `update`, the second of the two WPKL passes.
+    """
+
+    def __init__(self, max_val: th.Tensor, bins: int):
+        """Create empty histograms.
+
+        Args:
+            max_val (th.Tensor): Normalization of shape [packets, channels].
+            bins (int): Number of bins.
+        """
+        self.max_val = max_val
+        self.bins = bins
+        self.counts = th.zeros(
+            max_val.shape + (bins,), dtype=th.int64, device=max_val.device
+        )
+
+    def update(self, packets: th.Tensor) -> None:
+        """Add a packet batch.
+
+        Args:
+            packets (th.Tensor): Packets of shape [batch_size, packets, channels, height, width].
+        """
+        self.counts += packet_histograms(
+            packets, self.max_val.to(packets.dtype), self.bins
+        )
+
+    def all_reduce(self, group: Optional[dist.ProcessGroup] = None) -> None:
+        """Sum the counts of all ranks, runs on the cpu for the gloo backend.
+
+        Args:
+            group (dist.ProcessGroup, optional): Process group to reduce over.
+                Defaults to the default group.
+        """
+        counts = self.counts.cpu()
+        dist.all_reduce(counts, group=group)
+        self.counts = counts.to(self.counts.device)
+
+
+def _transform_dataset(
+    dataset: Union[ImagePathDataset, ShardedImageDataset],
+    wavelet: str,
+    max_level: int,
+    log_scale: bool,
+    batch_size: int,
+    dtype: th.dtype,
+    accumulator: Union[PacketMaxima, PacketHistograms],
+) -> None:
+    """Transform a dataset batch by batch and feed the packets to an accumulator.
+
+    With a memory budget the batch size is reduced to fit the histograms.
+
+    Args:
+        dataset (Union[ImagePathDataset, ShardedImageDataset]): Images with a `collate` method.
+        wavelet (str): Choice of wavelet.
+        max_level (int): Decomposition level.
+        log_scale (bool): Apply log scale.
+        batch_size (int): Batch size for packet decomposition.
+        dtype (th.dtype): Precision of the packet transform.
+        accumulator (Union[PacketMaxima, PacketHistograms]): Accumulator to update.
+    """
+    device = _get_device()
+    transform = WaveletPacketTransform(wavelet, max_level, log_scale)
+    batch_size = _plan_histogram_batch_size(
+        dataset, wavelet, max_level, batch_size, dtype
+    )
+    dataloader = _get_dataloader(dataset, batch_size)
+    with th.no_grad():
+        for img_batch in tqdm(_prefetch(dataloader, device), total=len(dataloader)):
+            accumulator.update(transform(_to_float_batch(img_batch, device, dtype)))
+    if _is_distributed():
+        accumulator.all_reduce()
+
+
+def _check_image_paths(paths: List[str]) -> None:
+    """Check that both paths exist and hold images.
+
+    Args:
+        paths (List[str]): Paths of source and generated images.
+
+    Raises:
+        RuntimeError: Error if a path doesn't exist.
+        ValueError: Error if a path holds saved statistics.
+    """
+    for path in paths:
+        if not os.path.exists(path):
+            raise RuntimeError(f"Invalid path: {path}")
+        if is_statistics_path(path):
+            raise ValueError(f"The WPKL needs images, got statistics: {path}")
+
+
+def _check_image_counts(
+    paths: List[str], datasets: List[Union[ImagePathDataset, ShardedImageDataset]]
+) -> None:
+    """Check that both paths hold the same number of images.
+
+    Args:
+        paths (List[str]): Paths of source and generated images.
+        datasets (List[Union[ImagePathDataset, ShardedImageDataset]]): Datasets of both paths.
+
+    Raises:
+        ValueError: Error if the numbers of images differ.
+    """
+    if len(datasets[0]) != len(datasets[1]):
+        raise ValueError(
+            f"The WPKL needs the same number of images in both paths, got "
+            f"{len(datasets[0])} in {paths[0]} and {len(datasets[1])} in {paths[1]}."
+        )
+
+
+def _compute_histogram_divergence(
+    paths: List[str],
+    datasets: List[Union[ImagePathDataset, ShardedImageDataset]],
+    maxima: List[PacketMaxima],
+    wavelet: str,
+    max_level: int,
+    log_scale: bool,
+    batch_size: int,
+    dtype: th.dtype,
+) -> float:
+    """Run the histogram pass over both datasets with their joint maxima.
+
+    Args:
+        paths (List[str]): Paths of source and generated images.
+        datasets (List[Union[ImagePathDataset, ShardedImageDataset]]): Datasets of both paths.
+        maxima (List[PacketMaxima]): Maxima of both datasets from the first pass.
+        wavelet (str): Choice of wavelet.
+        max_level (int): Decomposition level.
+        log_scale (bool): Apply log scale.
+        batch_size (int): Batch size for packet decomposition.
+        dtype (th.dtype): Precision of the packet transform.
+
+    Returns:
+        float: KL Wavelet Divergence.
+    """
+    max_val = _joint_max(maxima[0].max_val, maxima[1].max_val)
+    bins = _rice_bins(maxima[0].samples)
+    counts = []
+    for path, dataset in zip(paths, datasets):
+        print(f"Computing packet histograms of given path: {path}")
+        histograms = PacketHistograms(max_val, bins)
+        _transform_dataset(
+            dataset, wavelet, max_level, log_scale, batch_size, dtype, histograms
+        )
+        counts.append(histograms.counts)
+    return histogram_divergence(*counts)
+
+
+def compute_wpkl(
+    paths: List[str],
+    wavelet: str,
+    max_level: int,
+    log_scale: bool,
+    batch_size: int,
+    dtype: th.dtype = th.float64,
+) -> float:
+    """Compute Kullback-Leibler Wavelet Packet Divergence.
+
+    Both image sets are transformed twice, the first pass finds the maximum
+    of every packet and channel, the second accumulates the histograms.
+    Only one batch of packets is held in memory at a time.
+
+    Args:
+        paths (List[str]): Paths of source and generated images,
+            image directories or decoded image caches.
+        wavelet (str): Choice of wavelet.
+        max_level (int): Decomposition level.
+        log_scale (bool): Apply log scale.
+        batch_size (int): Batch size for packet decomposition.
+        dtype (th.dtype): Precision of the packet transform.
+            Defaults to th.float64.
+
+    Returns:
+        float: KL Wavelet Divergence.
+    """
+    _check_image_paths(paths)
+    datasets = [_get_dataset(path) for path in paths]
+    _check_image_counts(paths, datasets)
+    maxima = []
+    for path, dataset in zip(paths, datasets):
+        print(f"Computing packet maxima of given path: {path}")
+        packet_maxima = PacketMaxima(
+            (4**max_level, _get_image_shape(dataset)[0]), _get_device()
+        )
+        _transform_dataset(
+            dataset, wavelet, max_level, log_scale, batch_size, dtype, packet_maxima
+        )
+        maxima.append(packet_maxima)
+    return _compute_histogram_divergence(
+        paths, datasets, maxima, wavelet, max_level, log_scale, batch_size, dtype
+    )
+
+
+def compute_fwd_wpkl(
+    paths: List[str],
+    wavelet: str,
+    max_level: int,
+    log_scale: bool,
+    batch_size: int,
+    frechet_backend: str = "torch",
+    dtype: th.dtype = th.float64,
+    packets_per_pass: Optional[int] = None,
+) -> Tuple[float, float]:
+    """Compute the FWD and the WPKL sharing the packet transform.
+
+    The first pass over each image set accumulates the FWD statistics and
+    the packet maxima from the same transformed batch. The histograms need
+    the maxima of both sets, so they are counted in a second pass.
+    Computing both metrics apart transforms every image three times.
+    Like `compute_fwd`, `packets_per_pass` or a memory budget split the FWD
+    into groups of packets, every further group costs one more pass.
+
+    Args:
+        paths (List[str]): Paths of source and generated images,
+            image directories or decoded image caches.
+        wavelet (str): Choice of wavelet.
+        max_level (int): Decomposition level.
+        log_scale (bool): Apply log scale.
+        batch_size (int): Batch size for packet decomposition.
+        frechet_backend (str): Backend for the Frechet distances,
+            one of "scipy", "numpy" or "torch". Defaults to "torch".
+        dtype (th.dtype): Precision of the packet transform.
+            Defaults to th.float64.
+        packets_per_pass (int, optional): Number of packets whose FWD
+            statistics are accumulated at once. Defaults to None, which
+            processes all packets at once.
+
+    Returns:
+        Tuple[float, float]: Frechet Wavelet Distance and KL Wavelet Divergence.
+    """
+    _check_image_paths(paths)
+    datasets = [_get_dataset(path) for path in paths]
+    _check_image_counts(paths, datasets)
+    device = _get_device()
+    packet_no = 4**max_level
+    frechet_chunk = FRECHET_CHUNK_SIZE
+    plan = _plan_passes(
+        paths, wavelet, max_level, batch_size, frechet_backend, dtype, packets_per_pass
+    )
+    if plan is not None:
+        packets_per_pass, frechet_chunk = plan.packets_per_pass, plan.frechet_chunk
+    if packets_per_pass is None:
+        packets_per_pass = packet_no
+    distances, maxima = [], []
+    for start in range(0, packet_no, packets_per_pass):
+        packets = slice(start, min(start + packets_per_pass, packet_no))
+        if packets_per_pass < packet_no:
+            print(f"Computing packets {start} to {packets.stop - 1} of {packet_no}")
+        statistics = []
+        for path, dataset in zip(paths, datasets):
+            accumulators = []
+            if start == 0:
+                # the maxima cover all packets, the first pass finds them.
+                print(f"Computing stats and packet maxima for path: {path}")
+                maxima.append(
+                    PacketMaxima((packet_no, _get_image_shape(dataset)[0]), device)
+                )
+                accumulators.append(maxima[-1])
+            statistics.append(
+                _compute_dataset_statistics(
+                    dataset,
+                    wavelet,
+                    max_level,
+                    log_scale,
+                    batch_size,
+                    dtype,
+                    packets=packets,
+                    accumulators=accumulators,
+                ).compute(packed=True)
+            )
+
+        print("Computing Frechet distances for each packet.")
+        (mu_1, sigma_1), (mu_2, sigma_2) = statistics
+        distances.append(
+            calculate_frechet_distances(
+                mu_1,
+                sigma_1,
+                mu_2,
+                sigma_2,
+                backend=frechet_backend,
+                device=device,
+                packed=True,
+                chunk_size=frechet_chunk,
+            )
+        )
+    wpkl = _compute_histogram_divergence(
+        paths, datasets, maxima, wavelet, max_level, log_scale, batch_size, dtype
+    )
+    return float(np.mean(np.concatenate(distances))), wpkl
@@ -0,0 +1,44 @@
+"""Fixtures shared by the test modules."""
+
+import numpy as np
+import pytest
+from PIL import Image
+
+
+def _write_images(image_dir, seed: int, number: int = 10) -> list:
+    rng = np.random.default_rng(seed)
+    image_dir.mkdir()
+    files = []
+    for pos in range(number):
+        array = rng.integers(0, 256, (16, 16, 3), dtype=np.uint8)
+        files.append(image_dir / f"{pos}.png")
+        Image.fromarray(array).save(files[-1])
+    return files
+
+
+@pytest.fixture
+def image_files(tmp_path):
+    """Write random png images to disk.
+
+    Args:
+        tmp_path: Pytest temporary directory.
+
+    Returns:
+        list: Paths to the images.
+    """
+    return _write_images(tmp_path / "images", seed=0)
+
+
+@pytest.fixture
+def image_dirs(image_files, tmp_path):
+    """Write a second folder of random png images next to `image_files`.
+
+    Args:
+        image_files: Images written by the fixture.
+        tmp_path: Pytest temporary directory.
+
+    Returns:
+        list: The real and the generated image directory.
+    """
+    _write_images(tmp_path / "generated", seed=1)
+    return [str(image_files[0].parent), str(tmp_path / "generated")]
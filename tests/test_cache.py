@@ -0,0 +1,161 @@
+"""Test the image and statistics caches and saved statistics."""
+
+import os
+
+import numpy as np
+import pytest
+import torch as th
+import torch.distributed as dist
+
+from pytorchfwd import fwd
+from pytorchfwd.cache import (
+    ShardedImageDataset,
+    StatisticsCache,
+    cache_images,
+    fingerprint,
+    is_image_cache,
+)
+from pytorchfwd.statistics import PacketStatistics
+from pytorchfwd.utils import ImagePathDataset
+
+
+def _load(dataset, batch_size):
+    dataloader = th.utils.data.DataLoader(
+        dataset, batch_size=batch_size, collate_fn=dataset.collate
+    )
+    return th.cat(list(dataloader))
+
+
+@pytest.mark.parametrize("batch_size", [3, 4])
+def test_image_cache(image_files, tmp_path, batch_size: int):
+    """Cached images have to match the decoded images.
+
+    Args:
+        image_files (list): Paths to the images.
+        tmp_path: Pytest temporary directory.
+        batch_size (int): Loader batch size.
+    """
+    cache_dir = str(tmp_path / "cache")
+    cache_images(image_files, cache_dir, batch_size=3, shard_size=4)
+    assert is_image_cache(cache_dir)
+    cached = ShardedImageDataset(cache_dir)
+    assert len(cached) == len(image_files)
+    expected = _load(ImagePathDataset(image_files), batch_size)
+    assert th.equal(_load(cached, batch_size), expected)
+
+
+def _cache_images_worker(rank: int, world_size: int, init_file: str, paths):
+    dist.init_process_group(
+        "gloo", init_method=f"file://{init_file}", rank=rank, world_size=world_size
+    )
+    fwd.NUM_PROCESSES = 0
+    fwd._cache_images(paths, 4)
+    # every rank sees the complete cache once the call returns.
+    assert len(ShardedImageDataset(paths[1])) == 10
+    dist.destroy_process_group()
+
+
+def test_distributed_image_cache(image_files, tmp_path):
+    """Only the main process writes the cache of a distributed run.
+
+    Args:
+        image_files: Images written by the fixture.
+        tmp_path: Pytest temporary directory.
+    """
+    paths = [str(image_files[0].parent), str(tmp_path / "cache")]
+    th.multiprocessing.spawn(
+        _cache_images_worker, args=(2, str(tmp_path / "init"), paths), nprocs=2
+    )
+    expected = _load(ImagePathDataset(image_files), 4)
+    assert th.equal(_load(ShardedImageDataset(paths[1]), 4), expected)
+
+
+def test_fingerprint(image_files):
+    """Fingerprints have to change with the files and the parameters.
+
+    Args:
+        image_files (list): Paths to the images.
+    """
+    key = fingerprint(image_files, wavelet="Haar", max_level=2)
+    assert key == fingerprint(image_files, wavelet="Haar", max_level=2)
+    assert key != fingerprint(image_files, wavelet="Haar", max_level=3)
+    assert key != fingerprint(image_files[1:], wavelet="Haar", max_level=2)
+    stat = os.stat(image_files[0])
+    os.utime(image_files[0], ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    assert key != fingerprint(image_files, wavelet="Haar", max_level=2)
+
+
+def test_statistics_cache(tmp_path):
+    """The cache returns stored entries and evicts the least recently used ones.
+
+    Args:
+        tmp_path: Pytest temporary directory.
+    """
+    mu, sigma = np.ones((4, 8)), np.ones((4, 8, 8))
+    cache = StatisticsCache(str(tmp_path), max_size=2**30)
+    cache.put("a", mu, sigma)
+    cache.max_size = int(2.5 * os.path.getsize(tmp_path / "a.npz"))
+    assert cache.get("b") is None
+    for key in "abc":
+        cache.put(key, mu * ord(key), sigma)
+        # make the recency order independent of the file system time resolution.
+        os.utime(tmp_path / f"{key}.npz", (ord(key), ord(key)))
+    assert cache.get("a") is None
+    cached_mu, cached_sigma = cache.get("c")
+    assert np.array_equal(cached_mu, mu * ord("c"))
+    assert np.array_equal(cached_sigma, sigma)
+
+
+def test_cached_path_statistics(image_files, tmp_path, monkeypatch):
+    """Statistics of an image folder are cached per decoder.
+
+    Args:
+        image_files: Images written by the fixture.
+        tmp_path: Pytest temporary directory.
+        monkeypatch: Pytest monkeypatch fixture.
+    """
+    cache_dir = tmp_path / "stats_cache"
+    monkeypatch.setattr(fwd, "NUM_PROCESSES", 0)
+    monkeypatch.setattr(fwd, "STATS_CACHE", StatisticsCache(str(cache_dir), 2**30))
+    image_dir = str(image_files[0].parent)
+    for decoder in ("pil", "torchvision", "pil"):
+        monkeypatch.setattr(fwd, "DECODER", decoder)
+        fwd.calculate_path_statistics(image_dir, "Haar", 1, False, 4)
+    assert len(os.listdir(cache_dir)) == 2
+
+
+@pytest.mark.parametrize("suffix", [".npz", ""])
+def test_update_stats(image_files, tmp_path, monkeypatch, suffix: str):
+    """Updated statistics have to match statistics of the whole directory.
+
+    Args:
+        image_files: Images written by the fixture.
+        tmp_path: Pytest temporary directory.
+        monkeypatch: Pytest monkeypatch fixture.
+        suffix (str): Saves npz files or statistics directories.
+    """
+    monkeypatch.setattr(fwd, "NUM_PROCESSES", 0)
+    image_dir = str(image_files[0].parent)
+    params = ("Haar", 1, False, 3)
+    full_path = str(tmp_path / f"full{suffix}")
+    fwd._save_packets([image_dir, full_path], *params)
+
+    held_back = tmp_path / "held_back"
+    held_back.mkdir()
+    for name in image_files[6:]:
+        name.rename(held_back / name.name)
+    stats_path = str(tmp_path / f"stats{suffix}")
+    fwd._save_packets([image_dir, stats_path], *params)
+    for name in image_files[6:]:
+        (held_back / name.name).rename(name)
+    fwd._update_stats([image_dir, stats_path], *params)
+
+    full = PacketStatistics.load(full_path)
+    updated = PacketStatistics.load(stats_path)
+    assert updated.count == full.count == len(image_files)
+    assert updated.files == full.files
+    assert np.allclose(updated.get_mu(), full.get_mu())
+    assert np.allclose(updated.get_sigma(), full.get_sigma())
+
+    with pytest.raises(RuntimeError):
+        fwd._update_stats([image_dir, stats_path], "sym5", 1, False, 3)
@@ -0,0 +1,85 @@
+"""Test the single decode multi-metric runner."""
+
+import os
+
+import numpy as np
+import pytest
+import torch as th
+import torchvision
+
+from pytorchfwd import evaluate, fwd
+from pytorchfwd.wpkl import compute_wpkl
+from scripts.fid import fid, inception
+
+
+def test_evaluate(image_dirs, monkeypatch):
+    """All metrics of one decode have to match the separate computations.
+
+    Args:
+        image_dirs: Real and generated images written by the fixture.
+        monkeypatch: Pytest monkeypatch fixture.
+    """
+    monkeypatch.setattr(fwd, "NUM_PROCESSES", 0)
+    # random weights, the comparison does not need the pretrained network.
+    monkeypatch.setattr(
+        inception,
+        "fid_inception_v3",
+        lambda: torchvision.models.inception_v3(
+            weights=None, aux_logits=False, init_weights=False
+        ),
+    )
+    # other test modules change the default dtype, fid.py and the model follow it.
+    default_dtype = th.get_default_dtype()
+    th.set_default_dtype(th.float32)
+    try:
+        _check_evaluate(image_dirs)
+    finally:
+        th.set_default_dtype(default_dtype)
+
+
+def _check_evaluate(paths):
+    th.manual_seed(0)
+    model = inception.InceptionV3([inception.InceptionV3.BLOCK_INDEX_BY_DIM[64]])
+    model.eval()
+    params = ("Haar", 2, False, 4)
+
+    results = evaluate.evaluate(
+        paths,
+        *params,
+        metrics=evaluate.METRICS,
+        feature_fn=lambda batch: fid.compute_features(model, batch),
+    )
+    assert np.allclose(results["fwd"], fwd.compute_fwd(paths, *params))
+    wpkl = compute_wpkl(paths, *params)
+    assert np.allclose(results["wpkl"], wpkl)
+    statistics = []
+    for path in paths:
+        files = fwd._get_image_names(path)
+        mu, sigma = fid.calculate_activation_statistics(
+            files, model, batch_size=4, dims=64
+        )
+        # plain sums of the activation batches as reference.
+        count, total, products = 0, np.zeros(64), np.zeros((64, 64))
+        for pred in fid.get_activations(files, model, batch_size=4, dims=64):
+            pred = pred.double().numpy()
+            count += len(pred)
+            total += pred.sum(axis=0)
+            products += pred.T @ pred
+        mean = total / count
+        assert np.allclose(mu, mean)
+        assert np.allclose(
+            sigma, (products - count * np.outer(mean, mean)) / (count - 1)
+        )
+        statistics.append((mu, sigma))
+    expected = fid.calculate_frechet_distance(*statistics[0], *statistics[1])
+    assert np.allclose(results["fid"], expected)
+
+    results = evaluate.evaluate(paths, *params, metrics=["wpkl"])
+    assert list(results) == ["wpkl"]
+    assert np.allclose(results["wpkl"], wpkl)
+
+    os.remove(os.path.join(paths[1], "0.png"))
+    with pytest.raises(ValueError):
+        evaluate.evaluate(paths, *params, metrics=["wpkl"])
+    with pytest.raises(ValueError):
+        evaluate.evaluate(paths, *params, metrics=["fid"])
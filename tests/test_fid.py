@@ -37,6 +37,21 @@ def forward_pass(images: th.Tensor) -> Tuple[np.ndarray, ...]:
     return mu, sigma
 
 
+def test_eigh_mode():
+    """The eigenvalue based trace has to match the sqrtm reference."""
+    rng = np.random.default_rng(0)
+    act1 = rng.normal(size=(128, 32))
+    act2 = rng.normal(loc=0.5, scale=2.0, size=(128, 32))
+    mu1, sigma1 = np.mean(act1, axis=0), np.cov(act1, rowvar=False)
+    mu2, sigma2 = np.mean(act2, axis=0), np.cov(act2, rowvar=False)
+    reference = calculate_frechet_distance(mu1, sigma1, mu2, sigma2)
+    eigh = calculate_frechet_distance(mu1, sigma1, mu2, sigma2, mode="eigh")
+    assert np.allclose(eigh, reference)
+    assert np.allclose(
+        calculate_frechet_distance(mu1, sigma1, mu1, sigma1, mode="eigh"), 0.0
+    )
+
+
 @pytest.mark.slow
 def test_same_input():
     """FID-test same input."""
@@ -1,5 +1,7 @@
 """Test wavelet packet transform."""
 
+import subprocess
+import sys
 from itertools import product
 from typing import Tuple
 
@@ -11,6 +13,7 @@ import scipy
 import torch as th
 
 from pytorchfwd.freq_math import (
+    WaveletPacketTransform,
     forward_wavelet_packet_transform,
     generate_frequency_packet_image,
 )
@@ -52,6 +55,37 @@ def test_inverse_wp():
     assert th.max(th.abs(reconstruction[:, :, :768, :1024] - face)) < 1e-5
 
 
+@pytest.mark.parametrize("wavelet", ["Haar", "db3", "sym5"])
+@pytest.mark.parametrize("level", [1, 2, 3])
+@pytest.mark.parametrize("size", [(32, 32), (45, 37)])
+def test_packet_transform_matches_ptwt(wavelet: str, level: int, size: Tuple[int, int]):
+    """The cached packet transform has to reproduce ptwt's packets.
+
+    Args:
+        wavelet (str): Choice of wavelet.
+        level (int): Decomposition level.
+        size (Tuple[int, int]): Image height and width.
+    """
+    images = th.rand((2, 3) + size, dtype=th.float64)
+    ptwt_packets = ptwt.WaveletPacket2D(images, pywt.Wavelet(wavelet), maxlevel=level)
+    expected = th.stack(
+        [ptwt_packets[node] for node in ptwt_packets.get_natural_order(level)], dim=1
+    )
+    transform = WaveletPacketTransform(wavelet, level, log_scale=False)
+    packets = transform(images)
+    assert packets.shape == expected.shape
+    assert th.allclose(packets, expected)
+
+
+def test_import_keeps_default_dtype():
+    """Importing the package must not change the global torch default dtype."""
+    code = (
+        "import torch, pytorchfwd.fwd; "
+        "assert torch.get_default_dtype() == torch.float32"
+    )
+    subprocess.run([sys.executable, "-c", code], check=True)
+
+
 def _fold_channels(input_tensor: th.Tensor) -> th.Tensor:
     """Fold a trailing (color-) channel into the batch dimension.
 
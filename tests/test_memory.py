@@ -0,0 +1,84 @@
+"""Test the memory planner."""
+
+import numpy as np
+import pytest
+import torch as th
+
+from pytorchfwd.freq_math import RunningStatistics, WaveletPacketTransform
+from pytorchfwd.memory import (
+    estimate_memory,
+    plan_histogram_batch_size,
+    plan_memory,
+)
+
+
+@pytest.mark.parametrize("wavelet", ["Haar", "sym5"])
+@pytest.mark.parametrize("shape", [(3, 32, 32), (1, 33, 40)])
+def test_estimate_memory(wavelet: str, shape):
+    """The estimated statistics size has to match the packets of the transform.
+
+    Args:
+        wavelet (str): Choice of wavelet.
+        shape: Image shape [channels, height, width].
+    """
+    packets = WaveletPacketTransform(wavelet, 2, False)(th.rand((2,) + shape))
+    packet_no, dim = packets.shape[1], np.prod(packets.shape[2:])
+    estimate = estimate_memory(shape, wavelet, 2, 2, packet_no, th.float64)
+    assert estimate["statistics"] == packet_no * dim * (dim + 1) * 8
+    assert estimate["transform"] >= 2 * packets.numel() * 8
+    assert estimate["total"] < sum(estimate.values()) - estimate["total"]
+
+
+def test_plan_memory():
+    """Plans have to fit into the budget, too small budgets need more passes."""
+    shape, budget = (3, 64, 64), 2**29
+    plan = plan_memory(shape, "sym5", 2, budget, 256)
+    assert plan.estimate["total"] <= budget
+    larger = estimate_memory(
+        shape, "sym5", 2, plan.batch_size, plan.packet_chunk + 1, th.float64
+    )
+    assert plan.packet_chunk == 16 or larger["total"] > budget
+    small = plan_memory(shape, "sym5", 2, 2**28 + 2**25, 256)
+    assert small.batch_size * small.packet_chunk < plan.batch_size * plan.packet_chunk
+    assert plan.packets_per_pass == 16
+    grouped = plan_memory(shape, "sym5", 2, plan.estimate["statistics"], 256)
+    assert grouped.packets_per_pass < 16
+    assert grouped.estimate["total"] <= plan.estimate["statistics"]
+    with pytest.raises(ValueError):
+        plan_memory(
+            shape, "sym5", 2, plan.estimate["statistics"], 256, packets_per_pass=16
+        )
+
+
+def test_plan_frechet():
+    """The Frechet chunk is planned apart and never costs passes over the images."""
+    shape, budget = (3, 32, 32), 3 * 2**20
+    plan = plan_memory(shape, "Haar", 2, budget, 128, frechet=True)
+    statistics_only = plan_memory(shape, "Haar", 2, budget, 128)
+    assert plan.packets_per_pass == statistics_only.packets_per_pass
+    assert plan.frechet_chunk < 16
+    assert plan.estimate["frechet"] <= budget
+    with pytest.raises(ValueError, match="Frechet"):
+        plan_memory(shape, "Haar", 2, 2**20, 128, frechet=True)
+
+
+def test_plan_histogram_batch_size():
+    """The WPKL passes hold no statistics and fit larger batches."""
+    shape, budget = (3, 64, 64), 2**26
+    batch_size = plan_histogram_batch_size(shape, "sym5", 2, budget, 256)
+    estimate = estimate_memory(shape, "sym5", 2, batch_size, 1, th.float64)
+    assert estimate["images"] + estimate["histograms"] <= budget
+    assert batch_size >= plan_memory(shape, "sym5", 2, budget, 256).batch_size
+    with pytest.raises(ValueError, match="WPKL"):
+        plan_histogram_batch_size(shape, "sym5", 2, 2**16, 256)
+
+
+def test_chunked_statistics():
+    """Updating packets in chunks must not change the statistics."""
+    samples = th.randn(12, 7, 5, dtype=th.float64)
+    full, chunked = RunningStatistics(), RunningStatistics(chunk_size=3)
+    for batch in th.split(samples, 5):
+        full.update(batch)
+        chunked.update(batch)
+    for expected, result in zip(full.compute(), chunked.compute()):
+        assert np.allclose(expected, result)
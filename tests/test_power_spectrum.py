@@ -1,5 +1,6 @@
 """Tests for KLDivergence Power Spectrum."""
 
+import os
 from copy import deepcopy
 from itertools import pairwise
 from typing import Tuple
@@ -8,7 +9,19 @@ import numpy as np
 import pytest
 import torch as th
 
-from scripts.wpkl.wpkl import compute_packets, wavelet_power_divergence
+from pytorchfwd import fwd
+from pytorchfwd.freq_math import WaveletPacketTransform, compute_kl_divergence
+from pytorchfwd.utils import ImagePathDataset, _to_float_batch
+from pytorchfwd.wpkl import (
+    PacketHistograms,
+    PacketMaxima,
+    compute_fwd_wpkl,
+    compute_wpkl,
+    histogram_divergence,
+    packet_histograms,
+    packet_max_abs,
+    wavelet_power_divergence,
+)
 from tests.test_wavelet_frechet_distance import (
     default_params,
     get_images,
@@ -19,6 +32,29 @@ th.set_default_dtype(th.float64)
 th.use_deterministic_algorithms(True)
 
 
+def _compute_packets(
+    dataloader: th.utils.data.DataLoader, wavelet: str, max_level: int, log_scale: bool
+) -> th.Tensor:
+    """Compute the packets of all batches and keep them as reference.
+
+    Args:
+        dataloader (th.utils.data.DataLoader): Image batches.
+        wavelet (str): Choice of wavelet.
+        max_level (int): Decomposition level.
+        log_scale (bool): Apply log scale.
+
+    Returns:
+        th.Tensor: Packets of shape [images, packets, channels, height, width].
+    """
+    transform = WaveletPacketTransform(wavelet, max_level, log_scale)
+    packets = []
+    for img_batch in dataloader:
+        if isinstance(img_batch, list):
+            img_batch = img_batch[0]
+        packets.append(transform(_to_float_batch(img_batch, "cpu", th.float64)))
+    return th.cat(packets, dim=0)
+
+
 def _calc_klwd(target_images: th.Tensor, output_images: th.Tensor) -> float:
     """Compute KLDivergence Power spectrum.
 
@@ -30,9 +66,9 @@ def _calc_klwd(target_images: th.Tensor, output_images: th.Tensor) -> float:
         float: WPKL value.
     """
     default_params["dataloader"] = make_dataloader(target_images)
-    target_packets = compute_packets(**default_params)
+    target_packets = _compute_packets(**default_params)
     default_params["dataloader"] = make_dataloader(output_images)
-    output_packets = compute_packets(**default_params)
+    output_packets = _compute_packets(**default_params)
 
     klwd = wavelet_power_divergence(target_packets, output_packets)
     return klwd
@@ -61,6 +97,139 @@ def test_shuffle_input():
     assert np.allclose(unshuffled_klwd, 0.0)
 
 
+def _loop_divergence(packets_0: th.Tensor, packets_1: th.Tensor) -> float:
+    """Compute the WPKL with one th.histogram call per packet and channel.
+
+    Args:
+        packets_0 (th.Tensor): Original packets.
+        packets_1 (th.Tensor): Target packets.
+
+    Returns:
+        float: Wavelet power divergence.
+    """
+    Bs, P, C, H, W = packets_0.shape
+    bins = int(2 * (Bs * H * W) ** (1 / 3))
+    klds = []
+    for p_ind in range(P):
+        for c_ind in range(C):
+            pack_0 = packets_0[:, p_ind, c_ind].flatten()
+            pack_1 = packets_1[:, p_ind, c_ind].flatten()
+            max_val = th.max(th.max(th.abs(pack_0)), th.max(th.abs(pack_1)))
+            max_val = th.tensor(1e-12, dtype=max_val.dtype) if max_val == 0 else max_val
+            hist_0, hist_1 = (
+                th.histogram(pack / max_val, bins=bins, range=(-1, 1), density=True)[0]
+                for pack in (pack_0, pack_1)
+            )
+            klds.append(
+                0.5
+                * (
+                    compute_kl_divergence(hist_0, hist_1)
+                    + compute_kl_divergence(hist_1, hist_0)
+                )
+            )
+    return float(th.mean(th.stack(klds)).item())
+
+
+def test_packet_histograms():
+    """Batched histograms match th.histogram on quantized images."""
+    rng = np.random.default_rng(0)
+    images = [
+        th.from_numpy(rng.integers(0, scale, (8, 3, 16, 16), dtype=np.uint8))
+        for scale in (256, 4)
+    ]
+    params = {"wavelet": "Haar", "max_level": 2, "log_scale": False}
+    # uint8 images are divided by 255, many coefficients fall on bin edges.
+    packets = [_compute_packets(make_dataloader(img), **params) for img in images]
+    max_val = th.maximum(*map(packet_max_abs, packets))
+    max_val = th.where(max_val == 0, th.full_like(max_val, 1e-12), max_val)
+    for packet_tensor in packets:
+        counts = packet_histograms(packet_tensor, max_val, bins=16)
+        assert counts.shape == (16, 3, 16)
+        for p_ind in range(16):
+            for c_ind in range(3):
+                hist = th.histogram(
+                    packet_tensor[:, p_ind, c_ind].flatten() / max_val[p_ind, c_ind],
+                    bins=16,
+                    range=(-1, 1),
+                )[0]
+                assert th.equal(counts[p_ind, c_ind].to(hist.dtype), hist)
+    assert wavelet_power_divergence(*packets) == pytest.approx(
+        _loop_divergence(*packets), rel=1e-12
+    )
+
+
+def test_streaming_divergence():
+    """Accumulating maxima and histograms batch by batch gives the same WPKL."""
+    target_images = get_images()
+    output_images = target_images.flip(-1) * 0.8
+    params = {"wavelet": "Haar", "max_level": 2, "log_scale": False}
+    packets = [
+        _compute_packets(make_dataloader(images), **params)
+        for images in (target_images, output_images)
+    ]
+    klwd = wavelet_power_divergence(*packets)
+
+    maxima = [PacketMaxima(packets[0].shape[1:3]) for _ in packets]
+    for packet_maxima, packet_tensor in zip(maxima, packets):
+        for packet_batch in packet_tensor.split(3):
+            packet_maxima.update(packet_batch)
+    max_val = th.maximum(maxima[0].max_val, maxima[1].max_val)
+    assert th.equal(max_val, th.maximum(*map(packet_max_abs, packets)))
+    bins = int(2 * maxima[0].samples ** (1 / 3))
+    histograms = [PacketHistograms(max_val, bins) for _ in packets]
+    for packet_histogram, packet_tensor in zip(histograms, packets):
+        for packet_batch in packet_tensor.split(3):
+            packet_histogram.update(packet_batch)
+    counts = [packet_histogram.counts for packet_histogram in histograms]
+    assert np.allclose(histogram_divergence(*counts), klwd)
+    assert klwd > 0
+
+
+def test_compute_fwd_wpkl(image_dirs, tmp_path, monkeypatch):
+    """The combined pass has to match the FWD and the WPKL computed apart.
+
+    Args:
+        image_dirs: Real and generated images written by the fixture.
+        tmp_path: Pytest temporary directory.
+        monkeypatch: Pytest monkeypatch fixture.
+    """
+    monkeypatch.setattr(fwd, "NUM_PROCESSES", 0)
+    paths = image_dirs
+    params = ("Haar", 2, False, 4)
+
+    packets = []
+    for path in paths:
+        dataset = ImagePathDataset(fwd._get_image_names(path))
+        dataloader = th.utils.data.DataLoader(
+            dataset, batch_size=4, collate_fn=dataset.collate
+        )
+        packets.append(_compute_packets(dataloader, *params[:3]))
+    expected = wavelet_power_divergence(*packets)
+    assert np.allclose(compute_wpkl(paths, *params), expected)
+
+    fwd_value, wpkl_value = compute_fwd_wpkl(paths, *params)
+    assert np.allclose(fwd_value, fwd.compute_fwd(paths, *params))
+    assert np.allclose(wpkl_value, expected)
+    # groups of packets and a memory budget must not change either metric.
+    grouped = compute_fwd_wpkl(paths, *params, packets_per_pass=5)
+    assert np.allclose(grouped, (fwd_value, wpkl_value))
+    monkeypatch.setattr(fwd, "MAX_MEMORY", 2**17)
+    assert np.allclose(compute_fwd_wpkl(paths, *params), (fwd_value, wpkl_value))
+    assert np.allclose(compute_wpkl(paths, *params), expected)
+    monkeypatch.setattr(fwd, "MAX_MEMORY", None)
+
+    stats_path = str(tmp_path / "real.npz")
+    fwd._save_packets([paths[0], stats_path], *params)
+    with pytest.raises(ValueError):
+        compute_wpkl([stats_path, paths[1]], *params)
+
+    os.remove(os.path.join(paths[1], "0.png"))
+    with pytest.raises(ValueError):
+        compute_wpkl(paths, *params)
+    with pytest.raises(ValueError):
+        compute_fwd_wpkl(paths, *params)
+
+
 @pytest.mark.slow
 @pytest.mark.parametrize("wavelet", ["sym5", "db5", "Haar"])
 @pytest.mark.parametrize("level", [2, 3])
@@ -0,0 +1,137 @@
+"""Test the saved statistics format."""
+
+import numpy as np
+import pytest
+import torch as th
+
+from pytorchfwd import fwd
+from pytorchfwd.freq_math import (
+    calculate_frechet_distances,
+    pack_symmetric,
+    unpack_symmetric,
+)
+from pytorchfwd.statistics import PacketStatistics, is_statistics_dir
+
+
+def _random_statistics(packets: int = 4, dim: int = 6) -> PacketStatistics:
+    rng = np.random.default_rng(0)
+    samples = rng.standard_normal((packets, 20, dim))
+    sigma = np.stack([np.cov(packet.T) for packet in samples])
+    return PacketStatistics(
+        np.mean(samples, axis=1),
+        sigma,
+        count=20,
+        files=["b.png", "a.png"],
+        params={"wavelet": "Haar", "max_level": 1, "log_scale": False},
+    )
+
+
+def test_pack_symmetric():
+    """Packing has to keep the upper triangle and unpacking restore the matrix."""
+    sigma = _random_statistics().sigma
+    packed = pack_symmetric(sigma)
+    assert packed.shape == (4, 21)
+    assert np.array_equal(unpack_symmetric(packed), sigma)
+    assert np.array_equal(unpack_symmetric(packed[1]), sigma[1])
+    packed_t = pack_symmetric(th.from_numpy(sigma))
+    assert np.array_equal(packed_t.numpy(), packed)
+    assert np.array_equal(unpack_symmetric(packed_t).numpy(), sigma)
+
+
+@pytest.mark.parametrize(
+    "packed,dtype,rtol",
+    [(False, "float64", 0), (True, "float64", 0), (True, "float32", 1e-6)],
+)
+def test_statistics_dir(tmp_path, packed: bool, dtype: str, rtol: float):
+    """Statistics directories are memory mapped and read packet by packet.
+
+    Args:
+        tmp_path: Pytest temporary directory.
+        packed (bool): Store only the upper triangles of sigma.
+        dtype (str): Storage precision of sigma.
+        rtol (float): Relative tolerance of the stored covariances.
+    """
+    statistics = _random_statistics()
+    path = str(tmp_path / "stats")
+    statistics.save(path, packed=packed, dtype=dtype)
+    assert is_statistics_dir(path)
+    loaded = PacketStatistics.load(path)
+    assert isinstance(loaded.sigma, np.memmap)
+    assert loaded.packed == packed and loaded.count == 20
+    assert loaded.files == ["a.png", "b.png"]
+    assert loaded.params == statistics.params
+    assert np.array_equal(loaded.get_mu(), statistics.mu)
+    assert np.allclose(loaded.get_sigma(), statistics.sigma, rtol=rtol, atol=0)
+    assert np.allclose(loaded.get_sigma(slice(1, 3)), statistics.sigma[1:3], rtol=rtol)
+    assert loaded.get_sigma(2).dtype == np.float64
+    # copies of the read-only memory maps, also for float64 storage.
+    assert loaded.get_mu().flags.writeable and loaded.get_sigma().flags.writeable
+    assert np.allclose(
+        loaded.get_sigma(packed=True), pack_symmetric(statistics.sigma), rtol=rtol
+    )
+
+    # saving again replaces the directory.
+    loaded.save(path)
+    assert not PacketStatistics.load(path).packed
+
+
+def test_statistics_npz(tmp_path):
+    """The npz format keeps dense float64 statistics.
+
+    Args:
+        tmp_path: Pytest temporary directory.
+    """
+    statistics = _random_statistics()
+    path = str(tmp_path / "stats.npz")
+    statistics.save(path)
+    loaded = PacketStatistics.load(path)
+    assert np.array_equal(loaded.get_sigma(), statistics.sigma)
+    assert loaded.params == statistics.params and loaded.count == 20
+    with pytest.raises(ValueError):
+        statistics.save(path, packed=True)
+
+
+def test_frechet_distances_of_saved_statistics(tmp_path):
+    """Saved statistics are read a chunk at a time by the Frechet distances.
+
+    Args:
+        tmp_path: Pytest temporary directory.
+    """
+    statistics = _random_statistics()
+    other = PacketStatistics(statistics.mu + 1, statistics.sigma * 2)
+    path = str(tmp_path / "stats")
+    statistics.save(path, packed=True)
+    loaded = PacketStatistics.load(path)
+    expected = calculate_frechet_distances(
+        statistics.mu, statistics.sigma, other.mu, other.sigma, backend="numpy"
+    )
+    distances = calculate_frechet_distances(
+        loaded.get_mu(),
+        loaded,
+        other.mu,
+        pack_symmetric(other.sigma),
+        backend="numpy",
+        packed=True,
+        chunk_size=3,
+    )
+    assert np.allclose(distances, expected)
+
+
+def test_save_packets_rejects_npz_options(image_files, tmp_path, monkeypatch):
+    """Packed or reduced precision npz output fails before any image is read.
+
+    Args:
+        image_files: Images written by the fixture.
+        tmp_path: Pytest temporary directory.
+        monkeypatch: Pytest monkeypatch fixture.
+    """
+
+    def fail(*args, **kwargs):
+        raise AssertionError("The statistics must not be computed.")
+
+    monkeypatch.setattr(fwd, "_compute_dataset_statistics", fail)
+    paths = [str(image_files[0].parent), str(tmp_path / "stats.npz")]
+    with pytest.raises(ValueError):
+        fwd._save_packets(paths, "Haar", 1, False, 4, packed=True)
+    with pytest.raises(ValueError):
+        fwd._save_packets(paths, "Haar", 1, False, 4, sigma_dtype="float16")
@@ -0,0 +1,96 @@
+"""Test the image loading utilities."""
+
+import numpy as np
+import pytest
+import torch as th
+from PIL import Image
+from torchvision.transforms import ToTensor
+
+from pytorchfwd.utils import ImagePathDataset, StageTimer, _to_float_batch
+
+
+@pytest.fixture
+def mixed_format_files(tmp_path):
+    """Write random png and jpeg images of 24x32 pixels to disk.
+
+    Args:
+        tmp_path: Pytest temporary directory.
+
+    Returns:
+        list: Paths to png and jpeg images.
+    """
+    rng = np.random.default_rng(0)
+    files = []
+    for pos in range(6):
+        array = rng.integers(0, 256, (24, 32, 3), dtype=np.uint8)
+        path = tmp_path / f"{pos}.{'png' if pos % 2 else 'jpg'}"
+        Image.fromarray(array).save(path)
+        files.append(path)
+    return files
+
+
+def _load(files, decoder):
+    dataset = ImagePathDataset(files, decoder=decoder)
+    dataloader = th.utils.data.DataLoader(
+        dataset, batch_size=4, collate_fn=dataset.collate
+    )
+    return th.cat(list(dataloader))
+
+
+def test_decoders(mixed_format_files):
+    """All decoder backends have to produce the same uint8 batches.
+
+    Args:
+        mixed_format_files (list): Paths to png and jpeg images.
+    """
+    pil_images = _load(mixed_format_files, "pil")
+    tv_images = _load(mixed_format_files, "torchvision")
+    assert pil_images.shape == (6, 3, 24, 32)
+    assert pil_images.dtype == tv_images.dtype == th.uint8
+    assert th.equal(pil_images[1::2], tv_images[1::2])
+    difference = pil_images[::2].int() - tv_images[::2].int()
+    assert th.max(th.abs(difference)) <= 2
+
+
+def test_to_float_batch(mixed_format_files):
+    """uint8 batches are scaled to [0, 1], float batches are only cast.
+
+    Args:
+        mixed_format_files (list): Paths to png and jpeg images.
+    """
+    images = _load(mixed_format_files, "pil")
+    floats = _to_float_batch(images, th.device("cpu"), th.float64)
+    assert floats.dtype == th.float64
+    assert th.allclose(floats * 255.0, images.double())
+    assert th.equal(_to_float_batch(floats, th.device("cpu"), th.float64), floats)
+
+
+def test_pil_transforms(mixed_format_files):
+    """Transforms of the pil decoder receive PIL images.
+
+    Args:
+        mixed_format_files (list): Paths to png and jpeg images.
+    """
+    dataset = ImagePathDataset(mixed_format_files, transforms=ToTensor())
+    floats = th.stack([dataset[pos] for pos in range(len(dataset))])
+    assert floats.is_floating_point()
+    assert th.allclose(
+        floats * 255.0, _load(mixed_format_files, "pil").to(floats.dtype)
+    )
+
+
+@pytest.mark.parametrize("enabled", [True, False])
+def test_stage_timer(enabled: bool):
+    """Timed iteration has to return all items and record every stage.
+
+    Args:
+        enabled (bool): Measure the stages.
+    """
+    timer = StageTimer(enabled=enabled)
+    items = []
+    for item in timer.iterate("load", range(3)):
+        with timer.stage("compute"):
+            items.append(item)
+    assert items == [0, 1, 2]
+    assert sorted(timer.times) == (["compute", "load"] if enabled else [])
+    assert timer.summary().endswith("s")
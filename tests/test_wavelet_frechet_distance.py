@@ -3,15 +3,23 @@
 import os
 from copy import deepcopy
 from itertools import pairwise
-from typing import Tuple
+from typing import List, Tuple
 
 import numpy as np
 import pytest
 import torch as th
+import torch.distributed as dist
 from sklearn.datasets import load_sample_images
 from torchvision import transforms
 
-from pytorchfwd.fwd import _compute_avg_frechet_distance, compute_packet_statistics
+from pytorchfwd import fwd
+from pytorchfwd.freq_math import RunningStatistics, calculate_frechet_distances
+from pytorchfwd.fwd import (
+    FWDMetric,
+    ReferenceStatistics,
+    _compute_avg_frechet_distance,
+    compute_packet_statistics,
+)
 
 os.environ["CUBLAS_WORKSPACE_CONFIG"] = ":4096:8"
 
@@ -94,6 +102,193 @@ def test_shuffle_input():
     assert np.allclose(shuffled_fwd, unshuffled_fwd, atol=1e-5)
 
 
+@pytest.mark.parametrize("batch_sizes", [[1] * 8, [3, 5], [8]])
+def test_running_statistics(batch_sizes: List[int]):
+    """Streamed statistics have to match the statistics of the full dataset.
+
+    Args:
+        batch_sizes (List[int]): Sizes of the batches fed to the accumulator.
+    """
+    samples = th.randn(sum(batch_sizes), 4, 12, dtype=th.float64)
+    statistics = RunningStatistics()
+    for batch in th.split(samples, batch_sizes):
+        statistics.update(batch)
+    mu, sigma = statistics.compute()
+    assert statistics.count == len(samples)
+    assert np.allclose(mu, th.mean(samples, dim=0).numpy())
+    expected_sigma = th.stack([th.cov(samples[:, p].T) for p in range(4)])
+    assert np.allclose(sigma, expected_sigma.numpy())
+
+    first, second = RunningStatistics(), RunningStatistics()
+    first.update(samples[:3])
+    second.update(samples[3:])
+    second_mean = second.mean.clone()
+    first.merge(second)
+    assert np.allclose(first.compute()[1], sigma)
+    assert th.equal(second.mean, second_mean)
+
+
+def test_running_statistics_compute_copies():
+    """Later updates must not change previously computed statistics."""
+    samples = th.randn(8, 4, 12, dtype=th.float64)
+    statistics = RunningStatistics()
+    statistics.update(samples[:4])
+    mu, sigma = statistics.compute()
+    expected_mu, expected_sigma = mu.copy(), sigma.copy()
+    statistics.update(samples[4:])
+    assert np.array_equal(mu, expected_mu)
+    assert np.array_equal(sigma, expected_sigma)
+
+
+def _all_reduce_worker(rank: int, world_size: int, init_file: str, shard_sizes):
+    dist.init_process_group(
+        "gloo", init_method=f"file://{init_file}", rank=rank, world_size=world_size
+    )
+    samples = th.randn(sum(shard_sizes), 4, 12, generator=th.Generator().manual_seed(0))
+    start = sum(shard_sizes[:rank])
+    statistics = RunningStatistics()
+    if shard_sizes[rank] > 0:
+        statistics.update(samples[start : start + shard_sizes[rank]])
+    statistics.all_reduce()
+    mu, sigma = statistics.compute()
+    dist.destroy_process_group()
+    assert statistics.count == len(samples)
+    assert np.allclose(mu, th.mean(samples, dim=0).numpy())
+    expected_sigma = th.stack([th.cov(samples[:, p].T) for p in range(4)])
+    assert np.allclose(sigma, expected_sigma.numpy())
+
+
+@pytest.mark.parametrize("shard_sizes", [[5, 3], [4, 0, 6]])
+def test_running_statistics_all_reduce(tmp_path, shard_sizes: List[int]):
+    """Statistics all-reduced across ranks have to match a single process.
+
+    Args:
+        tmp_path: Pytest temporary directory.
+        shard_sizes (List[int]): Number of samples of every rank.
+    """
+    th.multiprocessing.spawn(
+        _all_reduce_worker,
+        args=(len(shard_sizes), str(tmp_path / "init"), shard_sizes),
+        nprocs=len(shard_sizes),
+    )
+
+
+@pytest.mark.parametrize("backend", ["numpy", "torch"])
+def test_batched_frechet_distances(backend: str):
+    """The batched Frechet distances have to match the scipy reference.
+
+    Args:
+        backend (str): The batched backend under test.
+    """
+    rng = np.random.default_rng(0)
+    features = [rng.normal(size=(64, 4, 10)) for _ in range(2)]
+    mu1, mu2 = (np.mean(f, axis=0) for f in features)
+    sigma1, sigma2 = (
+        np.stack([np.cov(f[:, p], rowvar=False) for p in range(4)]) for f in features
+    )
+    reference = calculate_frechet_distances(mu1, sigma1, mu2, sigma2, backend="scipy")
+    batched = calculate_frechet_distances(mu1, sigma1, mu2, sigma2, backend=backend)
+    assert batched.shape == (4,)
+    assert np.allclose(batched, reference)
+
+
+def test_reference_statistics(tmp_path):
+    """Cached reference factorizations must not change the FWD.
+
+    Args:
+        tmp_path: Pytest temporary directory.
+    """
+    target_images = get_images()
+    output_images = target_images.flip(-1)
+    default_params["dataloader"] = make_dataloader(target_images)
+    mu1, sigma1 = compute_packet_statistics(**default_params)
+    default_params["dataloader"] = make_dataloader(output_images)
+    mu2, sigma2 = compute_packet_statistics(**default_params)
+    expected = _compute_avg_frechet_distance(mu1, mu2, sigma1, sigma2, "scipy")
+
+    stats_path = str(tmp_path / "reference.npz")
+    np.savez_compressed(stats_path, mu=mu1, sigma=sigma1)
+    for _ in range(2):
+        reference = ReferenceStatistics.from_path(
+            stats_path, "Haar", 1, False, batch_size=1
+        )
+        fwd = reference.frechet_distance(mu2, sigma2)
+        assert np.allclose(fwd, expected)
+        assert os.path.exists(tmp_path / "reference_sqrt_sigma.npy")
+
+
+def test_grouped_fwd(image_dirs, tmp_path, monkeypatch):
+    """Computing the FWD in groups of packets must not change it.
+
+    Args:
+        image_dirs: Real and generated images written by the fixture.
+        tmp_path: Pytest temporary directory.
+        monkeypatch: Pytest monkeypatch fixture.
+    """
+    monkeypatch.setattr(fwd, "NUM_PROCESSES", 0)
+    paths = image_dirs
+    params = ("Haar", 2, False, 4)
+    expected = fwd.compute_fwd(paths, *params)
+    assert np.allclose(fwd.compute_fwd(paths, *params, packets_per_pass=5), expected)
+    # a planned budget groups the packets and chunks the Frechet distances.
+    monkeypatch.setattr(fwd, "MAX_MEMORY", 2**17)
+    assert np.allclose(fwd.compute_fwd(paths, *params), expected)
+    monkeypatch.setattr(fwd, "MAX_MEMORY", None)
+
+    stats_path = str(tmp_path / "real.npz")
+    fwd._save_packets([paths[0], stats_path], *params)
+    grouped = fwd.compute_fwd([stats_path, paths[1]], *params, packets_per_pass=3)
+    assert np.allclose(grouped, expected)
+    reference = ReferenceStatistics.from_path(stats_path, *params)
+    grouped = fwd.compute_fwd([reference, paths[1]], *params, packets_per_pass=3)
+    assert np.allclose(grouped, expected)
+    # the groups slice the cached square roots of the reference.
+    assert reference._sqrt_sigma is not None
+    with pytest.raises(ValueError):
+        fwd.compute_fwd([paths[1], reference], *params)
+
+    stats_dir = str(tmp_path / "real_stats")
+    fwd._save_packets([paths[0], stats_dir], *params, packed=True)
+    assert np.allclose(fwd.compute_fwd([stats_dir, paths[1]], *params), expected)
+    grouped = fwd.compute_fwd([stats_dir, paths[1]], *params, packets_per_pass=3)
+    assert np.allclose(grouped, expected)
+
+
+def test_fwd_metric():
+    """The tensor API has to match the dataloader based FWD."""
+    target_images = get_images()
+    output_images = target_images.flip(-1)
+    default_params["wavelet"] = "Haar"
+    default_params["max_level"] = 1
+    expected = _calc_fwd(target_images, output_images)
+
+    metric = FWDMetric(wavelet="Haar", max_level=1, device=th.device("cpu"))
+    metric.update(target_images, real=True)
+    metric.update(th.split(output_images, 3), real=False)
+    assert np.allclose(metric.compute(), expected)
+
+
+@pytest.mark.parametrize("img_size_level", [(32, 1), (64, 2)])
+def test_float32_precision(img_size_level: Tuple[int, int]):
+    """Float32 packets have to stay close to the float64 reference.
+
+    Args:
+        img_size_level (Tuple[int, int]): Tuple containing image size and transformation level.
+    """
+    size, level = img_size_level
+    target_images = get_images(size)
+    output_images = target_images.flip(-1)
+    fwds = []
+    for dtype in (th.float32, th.float64):
+        metric = FWDMetric(
+            wavelet="sym5", max_level=level, device=th.device("cpu"), dtype=dtype
+        )
+        metric.update(target_images, real=True)
+        metric.update(output_images, real=False)
+        fwds.append(metric.compute())
+    assert np.allclose(fwds[0], fwds[1], rtol=1e-5)
+
+
 @pytest.mark.slow
 @pytest.mark.parametrize("wavelet", ["sym5", "db5", "Haar"])
 @pytest.mark.parametrize("level", [1, 2])